@@ -18,25 +18,35 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-import crossref.restful as cr
-import requests
+import datetime, queue, requests, sqlite3, threading
+from concurrent.futures import ThreadPoolExecutor
 import utils
 
-def printPreprintPublicationFromMedrxiv(crossref, doiPreprint):
-    """Fetch and print metadata e.g. https://api.biorxiv.org/details/medrxiv/10.1101/2020.02.26.20026971"""
-    resp = requests.get(f"https://api.biorxiv.org/details/medrxiv/{doiPreprint}")
-    json = resp.json()
+printLock = threading.Lock()
+
+def printLines(lines):
+    """Prints lines without interleaving them with those of other threads"""
+    with printLock:
+        for line in lines:
+            print(line)
+
+def medrxivDetails(doiPreprint, archive='medrxiv'):
+    """Fetch metadata e.g. https://api.biorxiv.org/details/medrxiv/10.1101/2020.02.26.20026971"""
+    return utils.cachedGet(f"https://api.biorxiv.org/details/{archive}/{doiPreprint}").json()
+
+def preprintPublicationFromMedrxiv(crossref, doiPreprint, json=None, works=None, archive='medrxiv'):
+    """Returns the output line for a preprint, fetching metadata unless already fetched: *rXiv details as json and Crossref metadata in works (see utils.resolveDOIs)"""
+    json = json or medrxivDetails(doiPreprint, archive)
+    works = works or {}
     status = json['messages'][0]['status']
 
     if status != "ok":
-        print('# ' + doiPreprint + ' has KO status: ' + status)
-        return
+        return '# ' + doiPreprint + ' has KO status: ' + status
     
     # medrxiv
     doiPublication = json['collection'][0]['published'].lower()
     if doiPublication == "na":
-        print('# ' + doiPreprint + ' has no associated publication DOI')
-        return
+        return '# ' + doiPreprint + ' has no associated publication DOI'
 
     mxPreprintEarliest = json['collection'][0]['date']
     mxPreprintLatest   = json['collection'][-1]['date']
@@ -44,12 +54,11 @@ def printPreprintPublicationFromMedrxiv(crossref, doiPreprint):
     mxPreprintAuthors  = json['collection'][-1]['authors']
 
     # crossref
-    crPreprint        = crossref.doi(doiPreprint)
-    crPublication     = crossref.doi(doiPublication) # (sometimes NoneType, e.g., 10.34171/mjiri.34.62)
+    crPreprint        = works.get(doiPreprint.lower()) or crossref.doi(doiPreprint)
+    crPublication     = works.get(doiPublication) or crossref.doi(doiPublication) # (sometimes NoneType, e.g., 10.34171/mjiri.34.62)
 
     if not crPreprint or not crPublication:
-        print(f"# WARNING: Preprint {doiPreprint} or Publication {doiPublication} not found via Crossref, thus skipping")
-        return
+        return f"# WARNING: Preprint {doiPreprint} or Publication {doiPublication} not found via Crossref, thus skipping"
 
     crPreprintTitle   = utils.cleanse(crPreprint['title'][0])
     # checked on 10.1101/19003376 (issued 9-AUG, created 10-AUG)
@@ -63,30 +72,236 @@ def printPreprintPublicationFromMedrxiv(crossref, doiPreprint):
     crPublicationAuthors = utils.fmtCrossrefAuthors(crPublication)
     crPublicationORCID   = crPublication['author'][0].get('ORCID') or ""
 
-    print('\t'.join([doiPreprint, doiPublication, mxPreprintEarliest, mxPreprintLatest, mxPreprintTitle, mxPreprintAuthors,
+    return '\t'.join([doiPreprint, doiPublication, mxPreprintEarliest, mxPreprintLatest, mxPreprintTitle, mxPreprintAuthors,
                                                 crPreprintDate, crPreprintTitle, crPreprintAuthors, crPreprintORCID,
-                                                crPublicationDate, crPublicationTitle, crPublicationAuthors, crPublicationORCID]))
+                                                crPublicationDate, crPublicationTitle, crPublicationAuthors, crPublicationORCID])
+
+def printPreprintPublicationFromMedrxiv(crossref, doiPreprint, json=None, works=None, archive='medrxiv'):
+    print(preprintPublicationFromMedrxiv(crossref, doiPreprint, json, works, archive))
+
+skippedErrors = (requests.RequestException, ValueError, utils.OfflineCacheMiss)  # failures of a preprint, skipped to be retried (e.g., persistent 5xx, open circuit, uncached in offline mode)
+skippedPrefixes = ('# Failed request for ', '# Uncached request in offline mode for ')
+
+def skippedLine(doi, error):
+    """Output line of a preprint skipped after one of the skippedErrors"""
+    return f'{skippedPrefixes[isinstance(error, utils.OfflineCacheMiss)]}{doi} thus skipping: {error}'
 
-def extractPreprintPublicationLinksFromMedrxiv(dois):
-    """Extract (doiPreprint, doiPublication) from medrxiv and associate metadata from Crossref"""
-    crossref = cr.Works(etiquette=utils.crossrefEtiquette())
+def preprintPublicationBatch(crossref, dois, archive='medrxiv', harvested=None, workers=1):
+    """Returns the output lines for a batch of preprints, whose Crossref metadata and that of their publications are resolved together.
+    The *rXiv details are taken from harvested (a function returning those of a DOI, or None when they are to be fetched), otherwise fetched with up to `workers` concurrent requests"""
+    details, failures = {}, {}
+    def fetchDetails(doi):
+        try:
+            return doi, (harvested and harvested(doi)) or medrxivDetails(doi, archive), None
+        except skippedErrors as e:
+            return doi, None, e
+    for doi, json, error in utils.orderedMap(fetchDetails, dois, workers):
+        if error:
+            failures[doi] = error
+        else:
+            details[doi] = json
+    publications = [json['collection'][0]['published'].lower() for json in details.values() if json['messages'][0]['status'] == 'ok' and json['collection'][0]['published'] != 'NA']
+    works = utils.resolveDOIs(crossref, list(details) + publications)
+    lines = []
     for doi in dois:
-        printPreprintPublicationFromMedrxiv(crossref, doi)
-    print(f"# {len(dois)} pairs in medrxiv gold.")
-
-def rxivPreprintsWithPublications(archive='medrxiv'):
-    """Queries *rXiv for preprints-publication links"""
-    preprintsWithPublications = set()
-    # https://api.biorxiv.org/details/medrxiv/2018-01-01/2020-07-10/10000
-    for cursor in range(0, 1000000, 100):  # json["messages"][0]["total"] + 100
-        json = requests.get(f"https://api.biorxiv.org/details/{archive}/2000-01-01/3000-01-01/{cursor}").json()  # the entire period of activity
-        if json["messages"][0]["status"] != 'ok': break # no more preprints to parse
-        for pp in json["collection"]:
-            print('\t'.join(["#", pp["doi"].lower(), pp["version"], pp["date"], pp["published"], utils.cleanse(pp["authors"]), utils.cleanse(pp["title"])]))
-            if pp["published"] != "NA":
-                preprintsWithPublications.add(pp["doi"].lower())
-    return preprintsWithPublications
+        try:
+            if doi in failures:
+                raise failures[doi]
+            lines.append(preprintPublicationFromMedrxiv(crossref, doi, details[doi], works, archive))
+        except skippedErrors as e:
+            utils.metrics.count('preprints_failed_total', archive=archive)
+            lines.append(skippedLine(doi, e))
+    return lines
+
+def extractPreprintPublicationLinksFromMedrxiv(dois, workers=1, archive='medrxiv'):
+    """Extract (doiPreprint, doiPublication) from medrxiv and associate metadata from Crossref, with up to `workers` batches processed concurrently.
+    dois may be a generator (see utils.streamDOIs), consumed as the batches are processed"""
+    crossref = utils.PoliteWorks(etiquette=utils.crossrefEtiquette())
+    nbDois = 0
+    # resolving 50 preprints and their 50 publications per Crossref request
+    for lines in utils.orderedMap(lambda batch: preprintPublicationBatch(crossref, batch, archive), utils.chunks(dois, 50), workers):
+        printLines(lines)
+        nbDois += len(lines)
+    print(f"# {nbDois} pairs in {archive} gold.")
+
+class HarvestCheckpoint:
+    """Persistent (SQLite) progress of a harvest: next cursor of each date window, harvested preprints and resolved pairs, so that a restarted harvest resumes where it stopped"""
+    def __init__(self, path=':memory:'):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS windows (archive TEXT, start TEXT, end TEXT, cursor INTEGER, done INTEGER, PRIMARY KEY (archive, start, end));
+            CREATE TABLE IF NOT EXISTS preprints (archive TEXT, start TEXT, end TEXT, doi TEXT, version TEXT, date TEXT, published TEXT, authors TEXT, title TEXT);
+            CREATE INDEX IF NOT EXISTS preprintsWindow ON preprints (archive, start, end);
+            CREATE INDEX IF NOT EXISTS preprintsDoi ON preprints (archive, doi);
+            CREATE TABLE IF NOT EXISTS pairs (archive TEXT, doi TEXT, line TEXT, PRIMARY KEY (archive, doi));''')
+        self.db.commit()
+
+    def window(self, archive, start, end):
+        """Returns the next cursor of a date window and whether it is done"""
+        with self.lock:
+            row = self.db.execute('SELECT cursor, done FROM windows WHERE archive = ? AND start = ? AND end = ?', (archive, start, end)).fetchone()
+        return (row[0], bool(row[1])) if row else (0, False)
+
+    def preprints(self, archive, start, end):
+        """Preprints harvested in a date window before a restart"""
+        with self.lock:
+            return [dict(zip(['doi', 'version', 'date', 'published', 'authors', 'title'], row)) for row in
+                    self.db.execute('SELECT doi, version, date, published, authors, title FROM preprints WHERE archive = ? AND start = ? AND end = ? ORDER BY rowid', (archive, start, end))]
+
+    def versions(self, archive, doi):
+        """Harvested versions of a preprint, by version number"""
+        with self.lock:
+            rows = self.db.execute('SELECT doi, version, date, published, authors, title FROM preprints WHERE archive = ? AND doi = ?', (archive, doi)).fetchall()
+        versions = {row[1]: dict(zip(['doi', 'version', 'date', 'published', 'authors', 'title'], row)) for row in rows}  # a version harvested twice (window resumed) counts once
+        return sorted(versions.values(), key=lambda version: int(version['version']))
+
+    def savePage(self, archive, start, end, cursor, done, preprints):
+        with self.lock:
+            self.db.executemany('INSERT INTO preprints VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', [(archive, start, end, pp['doi'].lower(), pp['version'], pp['date'], pp['published'], pp['authors'], pp['title']) for pp in preprints])
+            self.db.execute('INSERT OR REPLACE INTO windows VALUES (?, ?, ?, ?, ?)', (archive, start, end, cursor, int(done)))
+            self.db.commit()
+
+    def pair(self, archive, doi):
+        with self.lock:
+            row = self.db.execute('SELECT line FROM pairs WHERE archive = ? AND doi = ?', (archive, doi)).fetchone()
+        return row[0] if row else None
+
+    def savePair(self, archive, doi, line):
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO pairs VALUES (?, ?, ?)', (archive, doi, line))
+            self.db.commit()
+
+def dateWindows(start, end, days=30):
+    """Splits [start, end] into consecutive windows of the given number of days, as pairs of ISO dates"""
+    start, end = datetime.date.fromisoformat(start), datetime.date.fromisoformat(end)
+    while start <= end:
+        windowEnd = min(end, start + datetime.timedelta(days=days - 1))
+        yield start.isoformat(), windowEnd.isoformat()
+        start = windowEnd + datetime.timedelta(days=1)
+
+def harvestWindow(archive, start, end, checkpoint, emit):
+    """Queries *rXiv for the preprints posted in a date window, resuming from the checkpointed cursor, and emits each of them.
+    Returns whether the window is done (not when a page is uncached in offline mode)"""
+    for pp in checkpoint.preprints(archive, start, end):  # pages fetched before a restart
+        emit(archive, pp)
+    cursor, done = checkpoint.window(archive, start, end)
+    while not done:
+        # https://api.biorxiv.org/details/medrxiv/2018-01-01/2020-07-10/100
+        try:
+            with utils.metrics.timer('stage_seconds', stage='harvest'):
+                json = utils.cachedGet(f"https://api.biorxiv.org/details/{archive}/{start}/{end}/{cursor}").json()
+        except utils.OfflineCacheMiss as e:
+            printLines([f'# Uncached request in offline mode for the {archive} window {start}/{end} thus skipping it from cursor {cursor}: {e}'])
+            return False
+        message = json["messages"][0]
+        preprints = json.get("collection", []) if message["status"] == 'ok' else []  # no (more) preprints to parse
+        cursor += len(preprints)
+        done = len(preprints) < 100 or ('total' in message and cursor >= int(message['total']))
+        checkpoint.savePage(archive, start, end, cursor, done, preprints)
+        utils.metrics.count('preprints_harvested_total', len(preprints), archive=archive)
+        for pp in preprints:
+            emit(archive, pp)
+    return True
+
+def resolvePairs(crossref, pending, checkpoint, harvested=None):
+    """Enrichment stage: resolves the (archive, doiPreprint) pairs put in the pending queue by batches of 50, until None is put (and left for the other enrichers),
+    taking the *rXiv details from harvested(archive, doi) when available (see preprintPublicationBatch)"""
+    finished = False
+    while not finished:
+        batch = [pending.get()]
+        while len(batch) < 50 and not pending.empty():
+            batch.append(pending.get())
+        if None in batch:
+            batch.remove(None)
+            pending.put(None)
+            finished = True
+        for archive in sorted(set(archive for archive, doi in batch)):
+            dois = [doi for a, doi in batch if a == archive and checkpoint.pair(a, doi) is None]
+            with utils.metrics.timer('stage_seconds', stage='enrich'):
+                lines = preprintPublicationBatch(crossref, dois, archive, harvested and (lambda doi: harvested(archive, doi))) if dois else []
+            failed = {}
+            for doi, line in zip(dois, lines):
+                if line.startswith(skippedPrefixes):  # left out of the checkpoint to be resolved on restart
+                    failed[doi] = line
+                else:
+                    checkpoint.savePair(archive, doi, line)
+            utils.metrics.count('pairs_resolved_total', len(dois) - len(failed), archive=archive)
+            printLines([failed.get(doi) or checkpoint.pair(a, doi) for a, doi in batch if a == archive])
+
+def rxivPreprintsWithPublications(archives=('medrxiv',), start='2013-11-01', end=None, windowDays=30, workers=4, checkpoint=None):
+    """Queries *rXiv for preprints-publication links, harvesting date windows in parallel while `workers` concurrent enrichers resolve the pairs found via Crossref.
+    The details of a preprint are taken from its harvested versions once they are known to be complete, and fetched from *rXiv otherwise"""
+    checkpoint = checkpoint or HarvestCheckpoint()
+    crossref = utils.PoliteWorks(etiquette=utils.crossrefEtiquette())
+    pending = queue.Queue()
+    seen = set()
+    seenLock = threading.Lock()
+
+    def emit(archive, pp):
+        printLines(['\t'.join(["#", pp["doi"].lower(), pp["version"], pp["date"], pp["published"], utils.cleanse(pp["authors"]), utils.cleanse(pp["title"])])])
+        if pp["published"] != "NA":
+            with seenLock:
+                if (archive, pp["doi"].lower()) in seen:
+                    return
+                seen.add((archive, pp["doi"].lower()))
+            pending.put((archive, pp["doi"].lower()))
+
+    windows = [(archive, s, e) for archive in archives for s, e in dateWindows(start, end or datetime.date.today().isoformat(), windowDays)]
+    harvestedWindows = set()
+    def harvested(archive, doi):
+        """Details of a preprint from its harvested versions when complete: from version 1, with every window that may hold a later version harvested"""
+        versions = checkpoint.versions(archive, doi)
+        if not versions or versions[0]['version'] != '1' or any(window not in harvestedWindows for window in windows if window[0] == archive and window[2] >= versions[-1]['date']):
+            return None
+        utils.metrics.count('details_reused_total', archive=archive)
+        return {'messages': [{'status': 'ok'}], 'collection': versions}
+    def harvest(window):
+        if harvestWindow(*window, checkpoint, emit):
+            harvestedWindows.add(window)
+
+    failures = []
+    def enrich():
+        try:
+            resolvePairs(crossref, pending, checkpoint, harvested)
+        except Exception as e:
+            failures.append(e)
+    enrichers = [threading.Thread(target=enrich) for _ in range(workers)]
+    for enricher in enrichers:
+        enricher.start()
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for _ in pool.map(harvest, windows):
+                pass
+    finally:
+        pending.put(None)
+        for enricher in enrichers:
+            enricher.join()
+    if failures:
+        raise failures[0]
+    print(f"# {len(seen)} pairs in {'+'.join(archives)} gold.")
+    return seen
 
 # Entry point
 if __name__ == '__main__':
-    extractPreprintPublicationLinksFromMedrxiv(rxivPreprintsWithPublications('medrxiv'))
\ No newline at end of file
+    import argparse
+    parser = argparse.ArgumentParser(description='Collect all preprint-publication pairs from medrxiv (and biorxiv)')
+    parser.add_argument('--archive', nargs='+', default=['medrxiv'], choices=['medrxiv', 'biorxiv'], help='*rXiv servers to harvest')
+    parser.add_argument('--from', dest='start', default='2013-11-01', help='harvest the preprints posted since this date (YYYY-MM-DD)')
+    parser.add_argument('--window-days', type=int, default=30, help='size of the date windows harvested in parallel')
+    parser.add_argument('--workers', type=int, default=4, help='number of date windows (or batches of the --doi-file) processed in parallel, and of enrichers resolving the pairs found')
+    parser.add_argument('--doi-file', metavar='FILE', help='instead of harvesting, extract the links of the preprints listed in this TSV file (possibly gzipped, or - for stdin)')
+    parser.add_argument('--checkpoint', metavar='SQLITE', help='progress saved after each page, to resume an interrupted harvest (e.g., harvest-checkpoint.sqlite)')
+    utils.addDOIInputArguments(parser)
+    utils.addHttpCacheArguments(parser)
+    utils.addMetricsArguments(parser)
+    args = parser.parse_args()
+    utils.enableHttpCacheFromArguments(parser, args)
+    utils.enableMetricsFromArguments(args)
+    try:
+        if args.doi_file:
+            extractPreprintPublicationLinksFromMedrxiv(utils.streamDOIsFromArguments(args.doi_file, args), args.workers, args.archive[0])
+        else:
+            rxivPreprintsWithPublications(args.archive, args.start, None, args.window_days, args.workers, HarvestCheckpoint(args.checkpoint) if args.checkpoint else None)
+    finally:
+        utils.writeMetricsFromArguments(args)
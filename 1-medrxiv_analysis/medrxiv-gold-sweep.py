@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# Sweep the thresholds and variants of the linker's decision rule over the medrxiv gold standard
+# @author <a href="mailto:guillaume.cabanac@univ-tlse3.fr">Guillaume Cabanac</a>
+# @since 17-OCT-2026
+
+# Copyright (C) 2026 Guillaume Cabanac
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os, re
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import utils
+
+# Evidence accepted, along with a title similarity above the low threshold, by each variant of the rule
+variants = {
+    'title only':                     lambda f: np.zeros(len(f['sim']), dtype=bool),
+    'first author':                   lambda f: f['firstAuthor'],
+    'ORCID':                          lambda f: f['orcid'],
+    'first author or ORCID':          lambda f: f['firstAuthor'] | f['orcid'],
+    'first author or ORCID, or author set': lambda f: f['firstAuthor'] | f['orcid'],  # rule of preprintPublicationLinker.py, with alwaysLinked
+    'first author and nb of authors': lambda f: f['firstAuthor'] & f['nbAut'],
+    '(first author or ORCID) and date': lambda f: (f['firstAuthor'] | f['orcid']) & f['date'],
+}
+# Pairs linked by a variant whatever the thresholds, e.g., by a clause with its own threshold
+alwaysLinked = {
+    'first author or ORCID, or author set': lambda f: f['authorSet'] & (f['sim'] >= 0.05),  # same set of 3+ authors (see preprintPublicationLinker.isMatch)
+}
+currentRule = ('first author or ORCID, or author set', 0.1, 0.8)
+
+def bylineKeys(byline, orcid):
+    """Author keys (see utils.authorKey) of a byline formatted as lastname, firstnames; ..., orcid being that of the first author"""
+    keys = []
+    for i, author in enumerate(byline.split('; ')):
+        family, _, given = author.partition(', ')
+        keys.append(utils.authorKey(family, given or None, orcid if i == 0 and orcid else None))
+    return tuple(keys)
+
+def loadGold(path='medrxiv-gold.tsv'):
+    """Preprints and publications of the gold pairs, as (date, title, authors, ORCID) tuples"""
+    gold = [re.split('[\t\n]', l) for l in open(path) if not l.startswith('#') and len(l.strip())]
+    return [tuple(g[6:10]) for g in gold], [tuple(g[10:14]) for g in gold]
+
+def pairFeatures(pairs):
+    """Features of medrxiv-gold-analyzer.py for (preprint, publication) pairs: title similarity, same first author, same ORCID, date order, nb of authors order, same author set"""
+    features = []
+    for (preDate, preTitle, preAuthors, preORCID), (pubDate, pubTitle, pubAuthors, pubORCID) in pairs:
+        try:
+            matchFirstAuthor = utils.sameFirstAuthorNameAndInitial(preAuthors, pubAuthors)
+        except IndexError:  # first author with an empty given name
+            matchFirstAuthor = False
+        features.append((utils.similarity(preTitle, pubTitle),
+                         matchFirstAuthor,
+                         preORCID == pubORCID if preORCID != '' and pubORCID != '' else False,
+                         preDate <= pubDate,  # ISO dates
+                         len(preAuthors.split(';')) <= len(pubAuthors.split(';')),
+                         utils.sameAuthorSet(bylineKeys(preAuthors, preORCID), bylineKeys(pubAuthors, pubORCID))))
+    return features
+
+def goldFeatures(preprints, publications, negatives=0, workers=os.cpu_count(), chunkSize=5000):
+    """Features of the gold pairs (positives) and of each preprint with `negatives` other publications (all of them when 0), computed by a pool of processes"""
+    n = len(preprints)
+    negatives = negatives or n - 1
+    pairs = [(preprints[i], publications[(i + offset) % n]) for offset in range(negatives + 1) for i in range(n)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        rows = [row for chunk in pool.map(pairFeatures, utils.chunks(pairs, chunkSize)) for row in chunk]
+    columns = list(zip(*rows))
+    return {'sim':         np.array(columns[0], dtype=np.float64),
+            'firstAuthor': np.array(columns[1], dtype=bool),
+            'orcid':       np.array(columns[2], dtype=bool),
+            'date':        np.array(columns[3], dtype=bool),
+            'nbAut':       np.array(columns[4], dtype=bool),
+            'authorSet':   np.array(columns[5], dtype=bool),
+            'gold':        np.arange(len(rows)) < n}
+
+def sweep(features, lows, highs):
+    """Counts of true/false positives of every variant and (low, high) thresholds, in one pass per variant:
+    a pair is linked when sim >= high or (sim >= low and evidence), i.e., when its similarity exceeds min(low, high) with evidence, high without, or when always linked"""
+    lows, highs = np.asarray(lows)[:, None], np.asarray(highs)[None, :]
+    results = {}
+    for name, evidence in variants.items():
+        evidence = evidence(features)
+        always = alwaysLinked[name](features) if name in alwaysLinked else np.zeros(len(features['sim']), dtype=bool)
+        counts = []
+        for gold in (features['gold'], ~features['gold']):
+            withEvidence    = np.sort(features['sim'][gold & evidence & ~always])
+            withoutEvidence = np.sort(features['sim'][gold & ~evidence & ~always])
+            above = lambda sims, thresholds: len(sims) - np.searchsorted(sims, thresholds, side='left')
+            counts.append(above(withEvidence, np.minimum(lows, highs)) + above(withoutEvidence, np.broadcast_to(highs, (lows.shape[0], highs.shape[1]))) + int((gold & always).sum()))
+        results[name] = counts  # (true positives, false positives), indexed by [low, high]
+    return results
+
+def fmtSweep(results, lows, highs, nbGold, top=20):
+    """TSV lines of the best rules by F1 score, followed by the current rule of the linker"""
+    rows = []
+    for name, (tp, fp) in results.items():
+        precision = np.divide(tp, tp + fp, out=np.zeros(tp.shape), where=tp + fp > 0)
+        recall = tp / nbGold
+        f1 = np.divide(2 * precision * recall, precision + recall, out=np.zeros(tp.shape), where=precision + recall > 0)
+        for i, low in enumerate(lows):
+            for j, high in enumerate(highs):
+                rows.append((f1[i, j], name, low, high, tp[i, j], fp[i, j], nbGold - tp[i, j], precision[i, j], recall[i, j]))
+    fmtRow = lambda r: '\t'.join([r[1], f'{r[2]:.2f}', f'{r[3]:.2f}', str(r[4]), str(r[5]), str(r[6]), f'{r[7]:.4f}', f'{r[8]:.4f}', f'{r[0]:.4f}'])
+    lines = ['\t'.join(['rule', 'low', 'high', 'TP', 'FP', 'FN', 'precision', 'recall', 'F1'])]
+    lines += [fmtRow(r) for r in sorted(rows, key=lambda r: (-r[0], r[1], r[2], r[3]))[:top]]
+    current = [r for r in rows if r[1] == currentRule[0] and np.isclose(r[2], currentRule[1]) and np.isclose(r[3], currentRule[2])]
+    lines += ['# current rule of the linker'] + [fmtRow(r) for r in current]
+    return lines
+
+# Entry point
+if __name__ == '__main__':
+    import argparse, time
+    parser = argparse.ArgumentParser(description='Evaluate a grid of thresholds and variants of the decision rule of the linker on the medrxiv gold standard')
+    parser.add_argument('--gold', default='medrxiv-gold.tsv', help='gold pairs as output by medrxiv-gold-collector.py')
+    parser.add_argument('--features', metavar='NPZ', help='features cache: loaded when it exists, saved otherwise (e.g., medrxiv-gold-features.npz)')
+    parser.add_argument('--negatives', type=int, default=0, help='number of other publications paired with each preprint as negatives (0: all of them)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of processes computing the features')
+    parser.add_argument('--step', type=float, default=0.05, help='step of the threshold grid')
+    parser.add_argument('--top', type=int, default=20, help='number of rules output')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.features and os.path.exists(args.features) and 'authorSet' in np.load(args.features):  # caches without authorSet are recomputed
+        features = dict(np.load(args.features))
+    else:
+        features = goldFeatures(*loadGold(args.gold), args.negatives, args.workers)
+        if args.features:
+            np.savez_compressed(args.features, **features)
+    loaded = time.perf_counter()
+    grid = np.round(np.arange(0, 1 + args.step / 2, args.step), 4)
+    results = sweep(features, grid, grid)
+    print('\n'.join(fmtSweep(results, grid, grid, int(features['gold'].sum()), args.top)))
+    print(f"# {int(features['gold'].sum())} gold pairs, {int((~features['gold']).sum())} negative pairs, {len(variants) * len(grid) ** 2} rules: "
+          f"features in {loaded - start:.2f}s, sweep in {time.perf_counter() - loaded:.2f}s")
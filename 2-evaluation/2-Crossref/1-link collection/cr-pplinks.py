@@ -20,20 +20,64 @@
 
 # Crossref (https://github.com/fabiobatalha/crossrefapi)
 import crossref.restful as cr
-import jmespath, requests
+import argparse, os, sys, threading
 
-cr = cr.Works(etiquette=cr.Etiquette('Preprint-Publication Linker', '1.0', 'https://www.irit.fr/~Guillaume.Cabanac', 'guillaume.cabanac@univ-tlse3.fr'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))  # shared routines of 2-evaluation/utils.py
+import utils
 
-# e.g., https://api.crossref.org/works?filter=relation.type%3Ais-preprint-of%2Cfrom-pub-date%3A2019-09%2Cuntil-pub-date%3A2019-09&sample=100&select=DOI%2Cpublisher%2Crelation
-for year in range(2017, 2020+1):
-    for month in range(1, 12+1):
-        ym = f'{year}-{month:02d}'
-        res = cr.filter(relation__type='is-preprint-of', from_pub_date=ym, until_pub_date=ym).select('DOI,relation,publisher').sample(100)
+prefixAgencies = {}  # registration agency of each DOI prefix, shared by all months
+prefixAgenciesLock = threading.Lock()
 
-        for i, preprint in zip(range(1, 100+1), res):
-            doiPublisher       = preprint['publisher']
-            doiPreprint        = preprint['DOI']
-            doiPublication     = preprint['relation']['is-preprint-of'][0]['id']
-            doiPublicationRegistrationAgency = jmespath.search('[0].RA', requests.get(f"https://doi.org/doiRA/{doiPublication}").json()) or "Unassigned"
+def registrationAgencies(dois, batchSize=20):
+    """Registration agency of each DOI (e.g., Crossref, DataCite) via https://doi.org/doiRA/{doi1},{doi2},...
+    As agencies are assigned per prefix, a single DOI is looked up per prefix unless it does not exist."""
+    def lookup(dois):
+        agencies = {}
+        for batch in utils.chunks(sorted(dois), batchSize):
+            for ra in utils.cachedGet(f"https://doi.org/doiRA/{','.join(batch)}").json():
+                if ra.get('RA'):
+                    agencies[ra['DOI'].lower()] = ra['RA']
+        return agencies
 
-            print(f'{ym}-{i:03d}\t{doiPreprint.lower()}\t{doiPublication.lower()}\t{doiPublisher}\t{doiPublicationRegistrationAgency}')
\ No newline at end of file
+    byPrefix = {}
+    for doi in dois:
+        byPrefix.setdefault(doi.split('/')[0], []).append(doi)
+    with prefixAgenciesLock:
+        unknown = [prefix for prefix in byPrefix if prefix not in prefixAgencies]
+    agencies = lookup([byPrefix[prefix][0] for prefix in unknown])
+    retry = [doi for prefix in unknown if byPrefix[prefix][0] not in agencies for doi in byPrefix[prefix][1:]]
+    agencies.update(lookup(retry))  # prefixes whose first DOI does not exist
+    with prefixAgenciesLock:
+        for prefix in unknown:
+            ra = next((agencies[doi] for doi in byPrefix[prefix] if doi in agencies), None)
+            if ra:
+                prefixAgencies[prefix] = ra
+        return {doi: prefixAgencies.get(doi.split('/')[0], "Unassigned") for doi in dois}
+
+def monthLinks(crossref, ym, full=False):
+    """Returns the output lines for the preprints published in month ym that have an is-preprint-of relation: a sample of 100 of them, or all of them (deep paging with a cursor)"""
+    # e.g., https://api.crossref.org/works?filter=relation.type%3Ais-preprint-of%2Cfrom-pub-date%3A2019-09%2Cuntil-pub-date%3A2019-09&sample=100&select=DOI%2Cpublisher%2Crelation
+    res = crossref.filter(relation__type='is-preprint-of', from_pub_date=ym, until_pub_date=ym).select('DOI,relation,publisher')
+    links = [(preprint['DOI'].lower(), preprint['relation']['is-preprint-of'][0]['id'].lower(), preprint['publisher']) for preprint in (res if full else res.sample(100))]
+    agencies = registrationAgencies([doiPublication for doiPreprint, doiPublication, doiPublisher in links])
+    return [f'{ym}-{i:03d}\t{doiPreprint}\t{doiPublication}\t{doiPublisher}\t{agencies[doiPublication]}' for i, (doiPreprint, doiPublication, doiPublisher) in enumerate(links, 1)]
+
+# Entry point
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Harvest preprint-publication links from Crossref')
+    parser.add_argument('--full', action='store_true', help='harvest every is-preprint-of relation instead of a sample of 100 per month')
+    parser.add_argument('--workers', type=int, default=4, help='number of months processed concurrently')
+    utils.addHttpCacheArguments(parser)
+    args = parser.parse_args()
+    utils.enableHttpCacheFromArguments(parser, args)
+
+    crossref = utils.PoliteWorks(etiquette=cr.Etiquette('Preprint-Publication Linker', '1.0', 'https://www.irit.fr/~Guillaume.Cabanac', 'guillaume.cabanac@univ-tlse3.fr'))
+    months = [f'{year}-{month:02d}' for year in range(2017, 2020+1) for month in range(1, 12+1)]
+    def monthLines(ym):
+        try:
+            return monthLinks(crossref, ym, args.full)
+        except utils.OfflineCacheMiss as e:
+            return [f'# Uncached request in offline mode for {ym} thus skipping: {e}']
+    for lines in utils.orderedMap(monthLines, months, args.workers):
+        for line in lines:
+            print(line)
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# Local index of candidate publications built from a Crossref metadata snapshot
+# @author <a href="mailto:guillaume.cabanac@univ-tlse3.fr">Guillaume Cabanac</a>
+# @since 17-OCT-2026
+
+# Copyright (C) 2026 Guillaume Cabanac
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import gzip, itertools, json, math, os, sqlite3, threading
+from unidecode import unidecode
+import utils
+
+def snapshotFiles(paths):
+    """Files of a snapshot, given as files or directories (walked in a stable order)"""
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.endswith(('.json', '.jsonl', '.json.gz', '.jsonl.gz')):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+
+def snapshotWorks(paths):
+    """Streams the works of a Crossref metadata snapshot: (gzipped) JSON lines, or JSON files with an items list as in the Crossref public data files"""
+    for path in snapshotFiles(paths):
+        with (gzip.open if path.endswith('.gz') else open)(path, 'rt', encoding='utf-8') as f:
+            try:
+                first = json.loads(f.readline() or '{}')
+            except json.JSONDecodeError:  # pretty-printed JSON file: loaded one file at a time
+                f.seek(0)
+                yield from json.load(f).get('items', [])
+                continue
+            for work in itertools.chain([first], map(json.loads, filter(str.strip, f))):
+                if 'items' in work:
+                    yield from work['items']
+                elif work:
+                    yield work
+
+def firstAuthorToken(family):
+    return 'author:' + unidecode(family).strip().lower()
+
+class CandidateIndex:
+    """Inverted index (SQLite) from title tokens and first author names to publications, standing in for the Crossref bibliographic query of the linker"""
+    types = ('journal-article', 'proceedings-article', 'book-chapter', 'book-part', 'book-section')  # same types as the Crossref query of the linker
+
+    def __init__(self, path='candidate-index.sqlite'):
+        self.path = path
+        self.local = threading.local()  # one connection per thread
+
+    @property
+    def db(self):
+        if not hasattr(self.local, 'db'):
+            self.local.db = sqlite3.connect(self.path)
+        return self.local.db
+
+    def build(self, works, batchSize=10000):
+        """Indexes the works of the relevant types, committing every batchSize works to keep memory bounded"""
+        db = self.db
+        db.executescript('''
+            DROP TABLE IF EXISTS works; DROP TABLE IF EXISTS postings; DROP TABLE IF EXISTS tokens;
+            CREATE TABLE works (id INTEGER PRIMARY KEY, doi TEXT UNIQUE, title TEXT, authors TEXT, created TEXT);
+            CREATE TABLE postings (token TEXT, work INTEGER);''')
+        relevant = (w for w in works if w.get('type') in self.types and w.get('created'))
+        nbWorks = 0
+        while True:
+            batch = list(itertools.islice(relevant, batchSize))
+            if not batch:
+                break
+            for work in batch:
+                title = utils.cleanse((work.get('title') or [''])[0])
+                authors = [{k: a[k] for k in ('family', 'given', 'name', 'ORCID') if k in a} for a in work.get('author', [])]
+                created = utils.fmtCrossrefDate(work['created']).isoformat()
+                cursor = db.execute('INSERT OR IGNORE INTO works (doi, title, authors, created) VALUES (?, ?, ?, ?)', (work['DOI'].lower(), title, json.dumps(authors), created))
+                if cursor.rowcount != 1:  # duplicate DOI
+                    continue
+                tokens = set(utils.titleTokenSet(title))
+                if authors and authors[0].get('family'):
+                    tokens.add(firstAuthorToken(authors[0]['family']))
+                db.executemany('INSERT INTO postings VALUES (?, ?)', ((token, cursor.lastrowid) for token in tokens))
+                nbWorks += 1
+            db.commit()
+        db.executescript('''
+            CREATE INDEX postingsToken ON postings (token);
+            CREATE TABLE tokens AS SELECT token, COUNT(*) AS df FROM postings GROUP BY token;
+            CREATE UNIQUE INDEX tokensToken ON tokens (token);''')
+        db.commit()
+        return nbWorks
+
+    def candidates(self, title, byline, fromDate, rows=20, maxTokens=8, maxDocFreq=0.05):
+        """Top candidates for a preprint, as Crossref items (DOI, title, author, created, score) ranked by the summed IDF of the rarest maxTokens shared tokens,
+        skipping the tokens of more than maxDocFreq of the works (e.g., covid-19), whose long postings add little IDF, unless no other token is shared"""
+        db = self.db
+        tokens = set(utils.titleTokenSet(title))
+        firstAuthor = byline.split(';')[0].split(',')[0]
+        if firstAuthor.strip():
+            tokens.add(firstAuthorToken(firstAuthor))
+        if not tokens:
+            return []
+        nbWorks = db.execute('SELECT MAX(id) FROM works').fetchone()[0] or 1
+        placeholders = ','.join('?' * len(tokens))
+        dfs = sorted(db.execute(f'SELECT df, token FROM tokens WHERE token IN ({placeholders})', list(tokens)))
+        if not dfs:
+            return []
+        dfs = ([(df, token) for df, token in dfs if df <= maxDocFreq * nbWorks] or dfs[:1])[:maxTokens]
+        idf = {token: math.log(nbWorks / df) for df, token in dfs}
+        placeholders = ','.join('?' * len(idf))
+        scores = {}
+        for token, work in db.execute(f'SELECT token, work FROM postings WHERE token IN ({placeholders})', list(idf)):
+            scores[work] = scores.get(work, 0.0) + idf[token]
+        res = []
+        for work, score in sorted(scores.items(), key=lambda ws: -ws[1]):
+            doi, workTitle, authors, created = db.execute('SELECT doi, title, authors, created FROM works WHERE id = ?', (work,)).fetchone()
+            if created < fromDate.isoformat():
+                continue
+            res.append({'DOI': doi, 'title': [workTitle], 'author': json.loads(authors), 'created': {'date-parts': [[int(part) for part in created.split('-')]]}, 'score': round(score, 5)})
+            if len(res) == rows:
+                break
+        return res
+
+# Entry point
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Build a local index of candidate publications from a Crossref metadata snapshot')
+    parser.add_argument('snapshot', nargs='+', help='(gzipped) JSON lines files, Crossref public data files, or directories of them')
+    parser.add_argument('--index', default='candidate-index.sqlite', help='index to (re)build')
+    args = parser.parse_args()
+    print(f'# {CandidateIndex(args.index).build(snapshotWorks(args.snapshot))} works indexed in {args.index}')
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# Compact records for preprints, candidate publications and links, and their streaming output
+# @author <a href="mailto:guillaume.cabanac@univ-tlse3.fr">Guillaume Cabanac</a>
+# @since 17-OCT-2026
+
+# Copyright (C) 2026 Guillaume Cabanac
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import datetime, json
+from collections import namedtuple
+
+# Tuple-backed records, in place of the full Crossref JSON of each work
+Preprint  = namedtuple('Preprint', 'doi title authors issued orcid')
+Candidate = namedtuple('Candidate', 'rank doi title authors created score similarity match')
+Link      = namedtuple('Link', 'preprintDoi publicationDoi score resultNbr preprintIssued publicationIssued publicationTitle publicationAuthors tier', defaults=['search'])  # tier: is-preprint-of, has-preprint, search or reverse
+Outcome   = namedtuple('Outcome', 'preprint candidates links')  # preprint is None when unresolvable
+
+# Parquet column types of the flat records (pyarrow type names, every column nullable), so that files have the same schema whatever their rows, even none
+columnTypes = {
+    Preprint:  {'doi': 'string', 'title': 'string', 'authors': 'string', 'issued': 'date32', 'orcid': 'string'},
+    Candidate: {'rank': 'int64', 'doi': 'string', 'title': 'string', 'authors': 'string', 'created': 'date32', 'score': 'float64', 'similarity': 'float64', 'match': 'bool_'},
+    Link:      {'preprintDoi': 'string', 'publicationDoi': 'string', 'score': 'float64', 'resultNbr': 'int64', 'preprintIssued': 'date32', 'publicationIssued': 'date32',
+                'publicationTitle': 'string', 'publicationAuthors': 'string', 'tier': 'string'},
+}
+
+def arrowSchema(recordType):
+    """pyarrow schema of a record type, see columnTypes"""
+    import pyarrow  # optional dependency, only needed for Parquet output
+    return pyarrow.schema([(field, getattr(pyarrow, columnTypes[recordType][field])()) for field in recordType._fields])
+
+def recordOf(recordType, row):
+    """Record of recordType from a row read by readRecords: dates back from their ISO format in JSON lines, and missing fields (from older files) to their defaults"""
+    return recordType(**{field: datetime.date.fromisoformat(row[field]) if columnTypes[recordType][field] == 'date32' and isinstance(row[field], str) else row[field]
+                         for field in recordType._fields if field in row})
+
+def jsonValue(value):
+    """JSON serialization of the record values that are not JSON types (dates)"""
+    return value.isoformat() if isinstance(value, datetime.date) else str(value)
+
+def linkTsv(link):
+    """Legacy TSV line of a link: its 8 columns before the tier (reported in a comment line instead), a missing score as an empty string"""
+    return '\t'.join('' if value is None else str(value) for value in link[:Link._fields.index('tier')])
+
+class RecordWriter:
+    """Streams records (of a single namedtuple type, Link by default) to a JSON lines (.jsonl) or Parquet (.parquet) file, written by row groups of rowGroupSize records.
+    The file is created right away, so that a run without any record still outputs an (empty) file"""
+    def __init__(self, path, rowGroupSize=10000, recordType=Link):
+        self.path = path
+        self.parquet = path.endswith('.parquet')
+        self.rowGroupSize = rowGroupSize
+        self.rows = []
+        if self.parquet:
+            import pyarrow.parquet  # optional dependency, only needed for Parquet output
+            self.writer = pyarrow.parquet.ParquetWriter(path, arrowSchema(recordType))
+        else:
+            self.file = open(path, 'w', encoding='utf-8')
+
+    def write(self, record):
+        self.rows.append(record._asdict())
+        if len(self.rows) >= self.rowGroupSize:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        if self.parquet:
+            import pyarrow
+            self.writer.write_table(pyarrow.Table.from_pylist(self.rows, schema=self.writer.schema))
+        else:
+            for row in self.rows:
+                self.file.write(json.dumps(row, default=jsonValue) + '\n')
+            self.file.flush()
+        self.rows = []
+
+    def close(self):
+        self.flush()
+        if self.parquet:
+            self.writer.close()
+        else:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def readRecords(path):
+    """Streams the rows (as dicts) of a file written by RecordWriter"""
+    if path.endswith('.parquet'):
+        import pyarrow.parquet  # optional dependency, only needed for Parquet input
+        for batch in pyarrow.parquet.ParquetFile(path).iter_batches():
+            yield from batch.to_pylist()
+    else:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
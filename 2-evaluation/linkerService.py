@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# Long-running service answering preprint-publication link queries over a local HTTP or Unix socket API
+# @author <a href="mailto:guillaume.cabanac@univ-tlse3.fr">Guillaume Cabanac</a>
+# @since 17-OCT-2026
+
+# Copyright (C) 2026 Guillaume Cabanac
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json, os, requests, socketserver, threading, time, urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import utils
+import preprintPublicationLinker as linker
+from linkRecords import jsonValue
+
+class LinkerService:
+    """State of the linker kept warm between queries: Crossref client (rate limiter, connection pools of utils.httpClient), score floor,
+    candidate index, and the caches of utils (HTTP responses, title tokens, author keys)"""
+    def __init__(self, index=None, rows=20, plan='wide', workers=8, maxBatch=1000):
+        self.crossref = utils.PoliteWorks(etiquette=utils.crossrefEtiquette())
+        self.index = index
+        self.rows = rows
+        self.plan = plan
+        self.floor = linker.ScoreFloor() if plan == 'adaptive' else None
+        self.workers = workers
+        self.maxBatch = maxBatch
+        self.started = time.time()
+        self.nbQueries = 0
+        self.lock = threading.Lock()
+
+    def link(self, dois):
+        """Outcomes of the preprints, in input order: links and output lines of printPreprintPublicationMatches (or an error)"""
+        dois = [utils.normalizeDOI(doi) for doi in dois]
+        with self.lock:
+            self.nbQueries += len(dois)
+        works = utils.resolveDOIs(self.crossref, dois, select='DOI,author,issued,relation,title')
+        def outcome(doi):
+            try:
+                lines, outcome = linker.preprintPublicationMatches(self.crossref, doi, self.index, works.get(doi), self.rows, self.plan, self.floor)
+            except utils.OfflineCacheMiss as e:
+                return {'doi': doi, 'error': f'uncached request in offline mode: {e}'}
+            except (requests.RequestException, ValueError) as e:  # e.g., persistent 5xx, open circuit
+                return {'doi': doi, 'error': str(e)}
+            return {'doi': doi, 'resolved': outcome.preprint is not None, 'links': [link._asdict() for link in outcome.links], 'lines': lines}
+        return list(utils.orderedMap(outcome, dois, self.workers))
+
+    def health(self):
+        return {'status': 'ok', 'uptimeSeconds': round(time.time() - self.started, 1), 'queries': self.nbQueries,
+                'httpCache': utils.httpCache.path if utils.httpCache else None, 'titleTokensCache': utils.titleTokens.cache_info()._asdict()}
+
+class LinkerHandler(BaseHTTPRequestHandler):
+    """GET /link?doi=...[&doi=...][&format=tsv], POST /link with {"dois": [...]} or one DOI per line, GET /health, GET /metrics"""
+    def do_GET(self):
+        parts = urllib.parse.urlsplit(self.path)
+        params = urllib.parse.parse_qs(parts.query)
+        if parts.path == '/link':
+            self.answerLinks(params.get('doi', []), params.get('format', ['json'])[0])
+        elif parts.path == '/health':
+            self.answer(200, self.server.service.health())
+        elif parts.path == '/metrics':
+            self.answer(200, utils.metrics.prometheus(), 'text/plain; version=0.0.4')
+        else:
+            self.answer(404, {'error': f'unknown endpoint {parts.path}'})
+
+    def do_POST(self):
+        parts = urllib.parse.urlsplit(self.path)
+        if parts.path != '/link':
+            return self.answer(404, {'error': f'unknown endpoint {parts.path}'})
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8')
+        if 'json' in self.headers.get('Content-Type', ''):
+            try:
+                dois = json.loads(body)['dois']
+            except (ValueError, KeyError, TypeError):
+                dois = None
+            if not isinstance(dois, list) or not all(isinstance(doi, str) for doi in dois):  # e.g., not a single DOI iterated by character
+                return self.answer(400, {'error': 'expecting {"dois": [...]} with a list of DOI strings'})
+        else:
+            dois = [line.split('\t')[0] for line in body.splitlines() if line.strip() and not line.startswith('#')]
+        self.answerLinks(dois, urllib.parse.parse_qs(parts.query).get('format', ['json'])[0])
+
+    def answerLinks(self, dois, format):
+        try:
+            self.answerLinksOf(dois, format)
+        except Exception as e:  # answered rather than dropping the connection
+            utils.metrics.count('service_errors_total')
+            self.answer(500, {'error': f'{type(e).__name__}: {e}'})
+
+    def answerLinksOf(self, dois, format):
+        service = self.server.service
+        if not dois:
+            return self.answer(400, {'error': 'no DOI given'})
+        if len(dois) > service.maxBatch:
+            return self.answer(413, {'error': f'{len(dois)} DOIs given, at most {service.maxBatch} per query'})
+        with utils.metrics.timer('service_query_seconds'):
+            outcomes = service.link(dois)
+        if format == 'tsv':
+            self.answer(200, '\n'.join(line for outcome in outcomes for line in outcome.get('lines', [f"# {outcome['doi']}: {outcome.get('error')}"])) + '\n', 'text/tab-separated-values')
+        else:
+            self.answer(200, {'outcomes': outcomes})
+
+    def answer(self, status, body, contentType='application/json'):
+        content = (body if isinstance(body, str) else json.dumps(body, default=jsonValue)).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', f'{contentType}; charset=utf-8' if 'charset' not in contentType else contentType)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):  # quiet
+        pass
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def linkerServer(service, address):
+    """HTTP server of the service, listening on HOST:PORT (e.g., 127.0.0.1:8765) or on a Unix socket (unix:/path/to/socket)"""
+    if address.startswith('unix:'):
+        path = address[len('unix:'):]
+        if os.path.exists(path):  # left by a previous run
+            os.remove(path)
+        server = ThreadingUnixHTTPServer(path, LinkerHandler)
+    else:
+        host, _, port = address.rpartition(':')
+        server = ThreadingHTTPServer((host or '127.0.0.1', int(port)), LinkerHandler)
+        server.daemon_threads = True
+    server.service = service
+    return server
+
+# Entry point
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Serve the preprint-publication linker over a local HTTP or Unix socket API, keeping its caches and connections warm')
+    parser.add_argument('--listen', default='127.0.0.1:8765', help='HOST:PORT or unix:PATH')
+    parser.add_argument('--workers', type=int, default=8, help='number of concurrent Crossref requests per query')
+    parser.add_argument('--index', metavar='SQLITE', help='take the candidates from this local index (built with candidateIndex.py) instead of the Crossref bibliographic query')
+    parser.add_argument('--rows', type=int, default=20, help='number of candidates fetched (in a single page) per query')
+    parser.add_argument('--plan', choices=['wide', 'adaptive'], default='wide', help='see preprintPublicationLinker.py')
+    parser.add_argument('--max-batch', type=int, default=1000, help='maximum number of DOIs per query')
+    parser.add_argument('--metrics', action='store_true', help='collect the metrics exposed at /metrics')
+    utils.addHttpCacheArguments(parser)
+    args = parser.parse_args()
+    utils.enableHttpCacheFromArguments(parser, args)
+    utils.metrics.enabled = args.metrics
+    index = None
+    if args.index:
+        import candidateIndex
+        index = candidateIndex.CandidateIndex(args.index)
+    server = linkerServer(LinkerService(index, args.rows, args.plan, args.workers, args.max_batch), args.listen)
+    print(f'# Serving the linker on {args.listen}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
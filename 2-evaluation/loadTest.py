@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# Load test of the linker and of the medrxiv collector against the local stand-in server
+# @author <a href="mailto:guillaume.cabanac@univ-tlse3.fr">Guillaume Cabanac</a>
+# @since 17-OCT-2026
+
+# Copyright (C) 2026 Guillaume Cabanac
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import contextlib, importlib.util, io, os, time, types
+import utils
+import preprintPublicationLinker as linker
+from standInServer import StandIn, goldFile, origins, startStandIn
+
+def loadCollector():
+    """medrxiv-gold-collector.py, whose name is not importable"""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '1-medrxiv_analysis', 'medrxiv-gold-collector.py')
+    spec = importlib.util.spec_from_file_location('medrxivGoldCollector', path)
+    collector = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(collector)
+    return collector
+
+def throughput(standIn, func, items, workers):
+    """(seconds, items per second, requests, injected errors, throttled requests) of func(items, workers), whose output is discarded"""
+    before = dict(standIn.stats)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        func(items, workers)
+    seconds = time.perf_counter() - start
+    return seconds, len(items) / seconds, *(standIn.stats[k] - before[k] for k in ('requests', 'errors', 'throttled'))
+
+def comparePlans(standIn, published, unpublished, plans=('wide', 'adaptive')):
+    """Recall of the gold publications (on the published preprints), preprints linked among the unpublished ones (false links), and requests per preprint of each plan of the linker"""
+    results = {}
+    for plan in plans:
+        result = {}
+        for name, dois in (('published', published), ('unpublished', unpublished)):
+            links = []
+            before = standIn.stats['requests']
+            with contextlib.redirect_stdout(io.StringIO()):
+                linker.inferPreprintPublicationLinksViaCrossref(dois, plan=plan, output=types.SimpleNamespace(write=links.append))
+            result[f'requestsPer{name.title()}'] = round((standIn.stats['requests'] - before) / len(dois), 2) if dois else 0.0
+            if name == 'published':
+                found = set((link.preprintDoi.lower(), link.publicationDoi.lower()) for link in links)
+                result['recall'] = round(sum((doi, standIn.gold[doi]) in found for doi in dois) / len(dois), 4) if dois else 0.0
+            else:
+                result['falseLinks'] = round(len(set(link.preprintDoi for link in links)) / len(dois), 4) if dois else 0.0
+        results[plan] = result
+    return results
+
+# Entry point
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Throughput of inferPreprintPublicationLinksViaCrossref and extractPreprintPublicationLinksFromMedrxiv against a local stand-in of the APIs')
+    parser.add_argument('--gold', default=goldFile, help='medrxiv-gold.tsv served by the stand-in')
+    parser.add_argument('--url', help='URL of a running standInServer.py (by default, one is started in this process)')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8, 16], help='concurrency levels tested')
+    parser.add_argument('--preprints', type=int, default=200, help='number of gold preprints processed per run')
+    parser.add_argument('--latency', type=float, default=0.05, help='mean latency of the stand-in in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of the requests answered with a 503 error by the stand-in')
+    parser.add_argument('--rate-limit', type=int, default=50, help='requests per second allowed by the stand-in')
+    parser.add_argument('--compare-plans', action='store_true', help='instead of the throughput, compare the recall, false links and requests per preprint of the adaptive and wide plans of the linker, '
+                                                                     'on --preprints published and --preprints unpublished preprints')
+    args = parser.parse_args()
+
+    standIn = StandIn(args.gold, args.latency, args.error_rate, args.rate_limit, seed=0)
+    url = args.url or f'http://127.0.0.1:{startStandIn(standIn).server_port}'
+    for origin in origins:
+        utils.httpClient.redirect(origin, url)
+    utils.httpClient.backoff = 0.1
+    utils.PoliteWorks.rateLimiter.update({'x-rate-limit-limit': str(args.rate_limit), 'x-rate-limit-interval': '1s'})
+    preprints = sorted(standIn.gold)[:args.preprints]
+    if args.compare_plans:
+        unpublished = standIn.unpublished[:args.preprints]
+        print(f'# {len(preprints)} published and {len(unpublished)} unpublished preprints, stand-in at {url}')
+        print('\t'.join(['plan', 'recall', 'falseLinks', 'requests/published', 'requests/unpublished']))
+        for plan, result in comparePlans(standIn, preprints, unpublished).items():
+            print('\t'.join([plan] + [str(result[k]) for k in ('recall', 'falseLinks', 'requestsPerPublished', 'requestsPerUnpublished')]))
+        raise SystemExit
+    collector = loadCollector()
+
+    print(f'# {len(preprints)} preprints, stand-in at {url} with {args.latency}s latency, {args.error_rate} error rate, {args.rate_limit} requests/s'
+          + (' (counts of a remote stand-in are not reported)' if args.url else ''))
+    print('\t'.join(['function', 'workers', 'seconds', 'preprints/s', 'requests', 'errors', 'throttled']))
+    for name, func in [('inferPreprintPublicationLinksViaCrossref', lambda dois, workers: linker.inferPreprintPublicationLinksViaCrossref(dois, workers)),
+                       ('extractPreprintPublicationLinksFromMedrxiv', collector.extractPreprintPublicationLinksFromMedrxiv)]:
+        for workers in args.workers:
+            seconds, rate, requests, errors, throttled = throughput(standIn, func, preprints, workers)
+            print('\t'.join([name, str(workers), f'{seconds:.2f}', f'{rate:.1f}', str(requests), str(errors), str(throttled)]))
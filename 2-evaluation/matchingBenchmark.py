@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# Offline benchmark of the matching pipeline, replaying the medrxiv gold standard
+# @author <a href="mailto:guillaume.cabanac@univ-tlse3.fr">Guillaume Cabanac</a>
+# @since 17-OCT-2026
+
+# Copyright (C) 2026 Guillaume Cabanac
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import datetime, json, os, sys, time, tracemalloc
+import utils
+import preprintPublicationLinker as linker
+
+goldFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '1-medrxiv_analysis', 'medrxiv-gold.tsv')
+
+def crossrefAuthors(byline):
+    """Crossref JSON for authors from a byline formatted as lastname, firstnames; ..."""
+    authors = []
+    for author in byline.split('; '):
+        family, _, given = author.partition(', ')
+        authors.append({'family': family, 'given': given} if given else {'name': family})
+    return authors
+
+def crossrefWork(doi, date, title, byline, orcid):
+    y, m, d = map(int, date.split('-'))
+    work = {'DOI': doi, 'title': [title], 'author': crossrefAuthors(byline), 'issued': {'date-parts': [[y, m, d]]}, 'created': {'date-parts': [[y, m, d]]}, 'score': 1.0}
+    if orcid:
+        work['author'][0]['ORCID'] = orcid
+    return work
+
+def loadGold(path=goldFile):
+    """Gold pairs (preprint and publication as Crossref JSON) and the titles and bylines of consecutive versions of the same preprint"""
+    pairs, versions, previous = [], [], None
+    for line in open(path, encoding='utf-8'):
+        row = line.rstrip('\n').split('\t')
+        if line.startswith('#\t'):  # harvest listing: #, doi, version, date, published, authors, title
+            if previous and previous[1] == row[1]:
+                versions.append((previous[6], row[6], previous[5], row[5]))
+            previous = row
+        elif line.strip() and not line.startswith('#'):
+            pairs.append((crossrefWork(row[0], row[6], row[7], row[8], row[9]), crossrefWork(row[1], row[10], row[11], row[12], row[13])))
+    return pairs, versions
+
+class GoldCrossref:
+    """Stand-in for crossrefapi Works, resolving the gold preprints"""
+    def __init__(self, pairs):
+        self.works = {preprint['DOI']: preprint for preprint, publication in pairs}
+
+    def doi(self, doi):
+        return self.works.get(doi)
+
+class GoldIndex:
+    """Stand-in for CandidateIndex, returning the gold publication among 19 other gold publications"""
+    path = 'gold'
+
+    def __init__(self, pairs, rows=20):
+        self.publications = [publication for preprint, publication in pairs]
+        self.positions = {preprint['title'][0]: i for i, (preprint, publication) in enumerate(pairs)}
+        self.rows = rows
+
+    def candidates(self, title, byline, fromDate, rows=20):
+        i = self.positions[title]
+        return [self.publications[(i + offset) % len(self.publications)] for offset in range(self.rows)]
+
+def timed(func, args):
+    """Latencies (in ns) of func called on each tuple of arguments"""
+    latencies = []
+    for arg in args:
+        start = time.perf_counter_ns()
+        func(*arg)
+        latencies.append(time.perf_counter_ns() - start)
+    return latencies
+
+def summary(latencies):
+    latencies = sorted(latencies)
+    percentile = lambda p: latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))] / 1000
+    return {'calls': len(latencies), 'callsPerSecond': round(len(latencies) / (sum(latencies) / 1e9), 1),
+            'p50Us': round(percentile(50), 2), 'p90Us': round(percentile(90), 2), 'p99Us': round(percentile(99), 2)}
+
+def runBenchmark(pairs, versions):
+    """Times each stage of the matching pipeline on the gold data, then measures the peak memory of the full decision"""
+    preprints = [preprint for preprint, publication in pairs]
+    publications = [publication for preprint, publication in pairs]
+    bylines = [(utils.fmtCrossrefAuthors(pp), utils.fmtCrossrefAuthors(pub)) for pp, pub in pairs] + [(v[2], v[3]) for v in versions]
+    bylines = [pair for pair in bylines if not pair[0].split(';')[0].rstrip().endswith(',')]  # first author with an empty given name (e.g., 'TRAiN study group,  ') fails the matcher
+    authorKeys = [(utils.authorKeys(pp), utils.authorKeys(pub)) for pp, pub in pairs]
+    titles = [(pp['title'][0], pub['title'][0]) for pp, pub in pairs] + [(v[0], v[1]) for v in versions]
+    crossref, index = GoldCrossref(pairs), GoldIndex(pairs)
+    decide = lambda doi: linker.preprintPublicationMatches(crossref, doi, index)
+
+    utils.titleTokens.cache_clear()
+    utils.titleTokenSet.cache_clear()
+    utils.authorKey.cache_clear()
+    results = {
+        'fmtCrossrefAuthors':            summary(timed(utils.fmtCrossrefAuthors, [(work,) for work in preprints + publications])),
+        'fmtCrossrefDate':               summary(timed(utils.fmtCrossrefDate, [(work['issued'],) for work in preprints + publications])),
+        'sameFirstAuthorNameAndInitial': summary(timed(utils.sameFirstAuthorNameAndInitial, bylines)),
+        'authorKeys':                    summary(timed(utils.authorKeys, [(work,) for work in preprints + publications])),
+        'sameFirstAuthor':               summary(timed(utils.sameFirstAuthor, authorKeys)),
+        'sameAuthorSet':                 summary(timed(utils.sameAuthorSet, authorKeys)),
+        'similarity (cold)':             summary(timed(utils.similarity, titles)),
+        'similarity (warm)':             summary(timed(utils.similarity, titles)),
+        'preprintPublicationMatches':    summary(timed(decide, [(pp['DOI'],) for pp in preprints])),
+    }
+    utils.titleTokens.cache_clear()
+    utils.titleTokenSet.cache_clear()
+    utils.authorKey.cache_clear()
+    tracemalloc.start()
+    found = sum(any(link.publicationDoi == pub['DOI'] for link in decide(pp['DOI'])[1].links) for pp, pub in pairs)
+    results['peakMemoryMB'] = round(tracemalloc.get_traced_memory()[1] / 2**20, 2)
+    tracemalloc.stop()
+    results['recall'] = round(found / len(pairs), 4)
+    return results
+
+def regressions(results, baseline, tolerance):
+    """Stages whose median latency exceeds that of the baseline by more than tolerance, and recall drops"""
+    slower = [f"{stage}: p50 {stats['p50Us']}us vs {baseline[stage]['p50Us']}us" for stage, stats in results.items()
+              if isinstance(stats, dict) and stage in baseline and stats['p50Us'] > baseline[stage]['p50Us'] * (1 + tolerance)]
+    if 'recall' in baseline and results['recall'] < baseline['recall']:
+        slower.append(f"recall: {results['recall']} vs {baseline['recall']}")
+    return slower
+
+# Entry point
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Offline benchmark of the matching pipeline on the medrxiv gold standard')
+    parser.add_argument('--gold', default=goldFile, help='medrxiv-gold.tsv as output by medrxiv-gold-collector.py')
+    parser.add_argument('--baseline', default='matchingBenchmark-baseline.json', help='results of a previous run to compare with')
+    parser.add_argument('--save-baseline', action='store_true', help='save the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown of the median latency with respect to the baseline')
+    args = parser.parse_args()
+
+    pairs, versions = loadGold(args.gold)
+    results = runBenchmark(pairs, versions)
+    print(f"# {len(pairs)} gold pairs and {len(versions)} pairs of versions, {datetime.datetime.now().isoformat(timespec='seconds')}")
+    print('\t'.join(['stage', 'calls', 'calls/s', 'p50 us', 'p90 us', 'p99 us']))
+    for stage, stats in results.items():
+        if isinstance(stats, dict):
+            print('\t'.join([stage] + [str(stats[k]) for k in ['calls', 'callsPerSecond', 'p50Us', 'p90Us', 'p99Us']]))
+    print(f"# peak memory of the full decision: {results['peakMemoryMB']} MB, recall of the gold publications: {results['recall']}")
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'# baseline saved to {args.baseline}')
+    elif os.path.exists(args.baseline):
+        slower = regressions(results, json.load(open(args.baseline)), args.tolerance)
+        for regression in slower:
+            print(f'# REGRESSION {regression}')
+        sys.exit(1 if slower else 0)
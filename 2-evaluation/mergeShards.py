@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# Merge the link records output by the shards of the linker (preprintPublicationLinker.py --shard I/N)
+# @author <a href="mailto:guillaume.cabanac@univ-tlse3.fr">Guillaume Cabanac</a>
+# @since 17-OCT-2026
+
+# Copyright (C) 2026 Guillaume Cabanac
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json, os, sys
+from linkRecords import Link, RecordWriter, readRecords, recordOf
+
+def shardManifests(paths):
+    """Manifests of the shard outputs that completed, by shard number (see preprintPublicationLinker.py)"""
+    manifests = {}
+    for path in paths:
+        if os.path.exists(path + '.manifest.json'):
+            manifest = json.load(open(path + '.manifest.json'))
+            manifest['path'] = path
+            manifests[manifest['shard']] = manifest
+    return manifests
+
+def failedShards(paths, nbShards):
+    """Shards (0 to nbShards - 1) without a completed output among paths"""
+    manifests = shardManifests(paths)
+    return [shard for shard in range(nbShards) if shard not in manifests or manifests[shard]['shards'] != nbShards]
+
+def mergeLinks(paths):
+    """Links of the shard outputs, de-duplicated on (preprintDoi, publicationDoi) and sorted by preprint then rank"""
+    links = {}
+    for path in paths:
+        for row in readRecords(path):
+            link = recordOf(Link, row)  # outputs older than the tier field are from the search
+            key = (link.preprintDoi, link.publicationDoi)
+            if key not in links or link.resultNbr < links[key].resultNbr:
+                links[key] = link
+    return sorted(links.values(), key=lambda link: (link.preprintDoi, link.resultNbr, link.publicationDoi))
+
+# Entry point
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Merge the link records of the shards of the linker into one deterministic, de-duplicated file')
+    parser.add_argument('shardOutputs', nargs='+', help='JSON lines or Parquet files written by preprintPublicationLinker.py --shard I/N --output FILE')
+    parser.add_argument('--shards', type=int, required=True, help='number of shards N')
+    parser.add_argument('--output', required=True, help='merged JSON lines (.jsonl) or Parquet (.parquet) file')
+    args = parser.parse_args()
+
+    manifests = shardManifests(args.shardOutputs)
+    completed = [manifests[shard]['path'] for shard in sorted(manifests) if manifests[shard]['shards'] == args.shards]
+    with RecordWriter(args.output) as output:
+        links = mergeLinks(completed)
+        for link in links:
+            output.write(link)
+    print(f'# {len(links)} links from {len(completed)}/{args.shards} shards merged into {args.output}')
+    failed = failedShards(args.shardOutputs, args.shards)
+    for shard in failed:
+        print(f'# FAILED shard {shard}/{args.shards}: rerun preprintPublicationLinker.py --shard {shard}/{args.shards}')
+    sys.exit(1 if failed else 0)
@@ -18,21 +18,104 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-import crossref.restful as cr
+import datetime, functools, json, math, os, requests, sqlite3, threading
 import utils
+from linkRecords import Candidate, Link, Outcome, Preprint, RecordWriter, linkTsv
 
-def printPreprintPublicationMatches(crossref, preprintDoi):
-    preprint = crossref.doi(preprintDoi)
-    if not preprint:  # Error Crossref e.g.
-        print(f'# Unresolvable DOI at Crossref {preprintDoi} thus skipping.')
-        return
+class LinkStateStore:
+    """Persistent (SQLite) record of the checks of each preprint, so that a daily run only queries the preprints that are due"""
+    def __init__(self, path='link-state.sqlite'):
+        self.db = sqlite3.connect(path)
+        self.db.execute('CREATE TABLE IF NOT EXISTS preprints (doi TEXT PRIMARY KEY, issued TEXT, checks INTEGER, lastCheck TEXT, nextCheck TEXT, bestSimilarity REAL, bestCandidate TEXT, link TEXT)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS runs (mode TEXT PRIMARY KEY, until TEXT)')
+        self.db.commit()
 
-    preprintTitle = preprint.get('title', [''])[0]
-    preprintAuthors = utils.fmtCrossrefAuthors(preprint)
-    preprintIssued  = utils.fmtCrossrefDate(preprint['issued'])  # checked on 10.1101/19003376 (issued 9-AUG, created 10-AUG)
+    def isLinked(self, doi):
+        row = self.db.execute('SELECT link FROM preprints WHERE doi = ?', (doi,)).fetchone()
+        return row is not None and row[0] is not None
+
+    def lastRun(self, mode):
+        """Date up to which the last run of mode (e.g., reverse) went, None if never run"""
+        row = self.db.execute('SELECT until FROM runs WHERE mode = ?', (mode,)).fetchone()
+        return datetime.date.fromisoformat(row[0]) if row else None
+
+    def saveRun(self, mode, until):
+        self.db.execute('INSERT OR REPLACE INTO runs VALUES (?, ?)', (mode, until.isoformat()))
+        self.db.commit()
+
+    def isDue(self, doi, today):
+        """New preprints and unlinked ones whose next check is today or earlier are due, linked ones never are"""
+        row = self.db.execute('SELECT link, nextCheck FROM preprints WHERE doi = ?', (doi,)).fetchone()
+        return row is None or (row[0] is None and row[1] <= today.isoformat())
 
+    @staticmethod
+    def recheckInterval(checks, issued, today):
+        """Days until the next check of an unlinked preprint: doubles after each check, capped at one day per month of age (and 90 days)"""
+        ageDays = (today - issued).days if issued else 0
+        return min(2 ** (checks - 1), max(1, ageDays // 30), 90)
+
+    def record(self, doi, outcome, today):
+        """Records a check of doi whose Outcome comes from preprintPublicationMatches"""
+        row = self.db.execute('SELECT checks, bestSimilarity, bestCandidate FROM preprints WHERE doi = ?', (doi,)).fetchone()
+        checks, bestSimilarity, bestCandidate = row if row else (0, None, None)
+        checks += 1
+        best = max(outcome.candidates, key=lambda candidate: candidate.similarity, default=None)
+        if best and (bestSimilarity is None or best.similarity > bestSimilarity):
+            bestSimilarity, bestCandidate = best.similarity, best.doi
+        link = outcome.links[0].publicationDoi if outcome.links else None
+        issued = outcome.preprint.issued if outcome.preprint else None
+        nextCheck = None if link else (today + datetime.timedelta(days=self.recheckInterval(checks, issued, today))).isoformat()
+        self.db.execute('INSERT OR REPLACE INTO preprints VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                        (doi, issued and issued.isoformat(), checks, today.isoformat(), nextCheck, bestSimilarity, bestCandidate, link))
+        self.db.commit()
+
+class ScoreFloor:
+    """Floor of the relative Crossref score (score / score of the top result) under which no further match is expected once a match is confirmed.
+    Learned as a low quantile of the relative scores of the matches confirmed so far, kept in a fixed histogram of 100 bins."""
+    def __init__(self, quantile=0.01, warmup=100):
+        self.quantile = quantile
+        self.warmup = warmup
+        self.bins = [0] * 101
+        self.nbScores = 0
+        self.lock = threading.Lock()
+
+    def observe(self, relativeScore):
+        with self.lock:
+            self.bins[min(100, max(0, int(relativeScore * 100)))] += 1
+            self.nbScores += 1
+
+    @property
+    def value(self):
+        """Learned floor, 0 (no cutoff) until warmup matches have been observed"""
+        if self.nbScores < self.warmup:
+            return 0.0
+        cumulated = 0
+        for i, count in enumerate(self.bins):
+            cumulated += count
+            if cumulated > self.quantile * self.nbScores:
+                return i / 100
+        return 0.0
+
+def isMatch(simTitles, preprintKeys, art):
+    """Decision rule of the linker for a candidate publication art, given its title similarity with the preprint whose authors are preprintKeys (see utils.authorKeys)"""
+    return simTitles >= 0.8 or (simTitles >= 0.1 and utils.sameFirstAuthor(preprintKeys, utils.authorKeys(art, 1))) \
+           or (simTitles >= 0.05 and utils.sameAuthorSet(preprintKeys, utils.authorKeys(art)))  # same set of 3+ authors, e.g., reordered (10.1101/2020.03.03.20030593)
+
+def candidateQueries(crossref, preprint, preprintTitle, preprintAuthors, preprintIssued, plan='wide'):
+    """Crossref queries for the candidates of a preprint, from the cheapest to the widest: the adaptive plan first queries the title and the family name of the first author
+    among journal articles only, then the title and the byline among the five types of publications (the original query)"""
+    if plan == 'adaptive':
+        firstAuthor = (preprint.get('author') or [{}])[0]
+        family = firstAuthor.get('family') or firstAuthor.get('name')
+        if family:
+            yield crossref.query(bibliographic=preprintTitle, author=family)\
+                          .filter(from_created_date=preprintIssued)\
+                          .filter(type='journal-article')\
+                          .select('author,created,DOI,score,title')\
+                          .sort('score')\
+                          .order('desc')
     # chop byline because otherwise ‘exceed max line 4096’ (e.g., for 10.1101/2020.09.03.20187252 -> https://tinyurl.com/yxwk9utg)
-    res = crossref.query(bibliographic=preprintTitle, author=preprintAuthors[0:2000])\
+    yield crossref.query(bibliographic=preprintTitle, author=preprintAuthors[0:2000])\
                   .filter(from_created_date=preprintIssued)\
                   .filter(type='journal-article')\
                   .filter(type='proceedings-article')\
@@ -43,32 +126,276 @@ def printPreprintPublicationMatches(crossref, preprintDoi):
                   .sort('score')\
                   .order('desc')
 
-    print(f"\n\n#--------------------------------------------------------------------------------------------------\n")
-    print(f"# Preprint: {preprintDoi}\n# Authors: {preprintAuthors}\n# Title: {preprintTitle}\n# {res.url}")
+def relatedPublications(crossref, preprint):
+    """Publications that the preprint metadata declares as its published versions (relation is-preprint-of, deposited by the preprint server)"""
+    dois = [relation['id'].lower() for relation in (preprint.get('relation') or {}).get('is-preprint-of', []) if relation.get('id-type') == 'doi']
+    if not dois:
+        return []
+    works = utils.resolveDOIs(crossref, dois, select='author,created,DOI,title')
+    return [work for work in (works.get(doi) or crossref.doi(doi) for doi in dois) if work and work.get('created')]
 
-    resultNbr = 1
-    for rank, art in zip(range(1, 20 + 1), res):  # fetching the top20 results only
-        publicationDoi = art['DOI'].lower()
-        publicationTitle = art.get('title', [''])[0].replace('\n\t', ' ')       # 10.1088/978-1-6432-7034-0ch1 has no title (found via query on 10.1101/268664)
-        publicationAuthors = utils.fmtCrossrefAuthors(art)
-        publicationIssued  = utils.fmtCrossrefDate(art['created'])    # checked on 10.1016/j.forsciint.2019.109924 & created more reliable than issued (see 10.2106/jbjs.oa.19.00049 where issue is 2020 only)
-        score = art['score']
+def relationQuery(crossref, preprintDoi):
+    """Crossref query for the publications declaring the preprint in their metadata (relation has-preprint, deposited by the publisher)"""
+    return crossref.filter(relation__type='has-preprint', relation__object=preprintDoi)\
+                   .select('author,created,DOI,score,title')
 
-        simTitles = utils.similarity(preprintTitle, publicationTitle)
-        matchFound = simTitles >= 0.8 or (simTitles >= 0.1 and (utils.sameFirstAuthorORCID(preprint, art) or utils.sameFirstAuthorNameAndInitial(preprintAuthors, publicationAuthors)))
+def preprintPublicationMatches(crossref, preprintDoi, index=None, preprint=None, rows=20, plan='wide', floor=None):
+    """Returns the output lines reporting the publications matching preprintDoi, along with their Outcome record.
+    Links are looked up by tiers, each link recording its tier: first the is-preprint-of relations of the preprint, then the publications declaring it with a has-preprint relation
+    (unless candidates come from a local index), and only when neither exists the search, whose candidates come from a single page of rows results of each Crossref query of the plan (see candidateQueries), widening only when nothing matches,
+    or from a local CandidateIndex when given. With a ScoreFloor, the candidates ranked below the floor are skipped once a match is found.
+    The preprint metadata is fetched unless already resolved (see utils.resolveDOIs)."""
+    lines = []
+    preprint = preprint or crossref.doi(preprintDoi)
+    if not preprint:  # Error Crossref e.g.
+        lines.append(f'# Unresolvable DOI at Crossref {preprintDoi} thus skipping.')
+        return lines, Outcome(None, [], [])
 
-        print("#" + str(rank))
-        if matchFound and not publicationDoi.startswith('10.2139/ssrn'):
-            print(f"{preprintDoi}\t{publicationDoi}\t{score}\t{resultNbr}\t{preprintIssued}\t{publicationIssued}\t{publicationTitle}\t{publicationAuthors}")
-            resultNbr += 1
+    preprintTitle = preprint.get('title', [''])[0]
+    preprintAuthors = utils.fmtCrossrefAuthors(preprint)
+    preprintIssued  = utils.fmtCrossrefDate(preprint['issued'])  # checked on 10.1101/19003376 (issued 9-AUG, created 10-AUG)
+    preprintKeys    = utils.authorKeys(preprint)
+    preprintRecord  = Preprint(preprintDoi, preprintTitle, preprintAuthors, preprintIssued, (preprint.get('author') or [{}])[0].get('ORCID'))
+
+    sources = [('is-preprint-of', f"Relation is-preprint-of of {preprintDoi}", functools.partial(relatedPublications, crossref, preprint))]
+    if index:
+        sources.append(('search', f"Candidates from local index {index.path}", lambda: index.candidates(preprintTitle, preprintAuthors, preprintIssued, rows)))
+    else:
+        query = relationQuery(crossref, preprintDoi)
+        sources.append(('has-preprint', query.url, functools.partial(query.top, rows)))
+        sources += [('search', query.url, functools.partial(query.top, rows)) for query in candidateQueries(crossref, preprint, preprintTitle, preprintAuthors, preprintIssued, plan)]
+
+    lines.append(f"\n\n#--------------------------------------------------------------------------------------------------\n")
+    lines.append(f"# Preprint: {preprintDoi}\n# Authors: {preprintAuthors}\n# Title: {preprintTitle}")
+
+    candidates, links = [], []
+    for tier, source, fetch in sources:
+        lines.append(f"# {source}")
+        with utils.metrics.timer('stage_seconds', stage='search' if tier == 'search' else 'relation'):
+            arts = fetch()
+        if tier == 'search':
+            utils.metrics.count('candidate_queries_total', plan=plan)
+            utils.metrics.observe('candidates_scanned', len(arts), utils.Metrics.countBuckets)
+        with utils.metrics.timer('stage_seconds', stage='scoring'):
+            publicationTitles = [art.get('title', [''])[0].replace('\n\t', ' ') for art in arts]  # 10.1088/978-1-6432-7034-0ch1 has no title (found via query on 10.1101/268664)
+            titleSimilarities = utils.similarities(preprintTitle, publicationTitles)
+            cutoff = floor.value * arts[0]['score'] if floor and arts and tier == 'search' else 0.0
+
+            resultNbr = 1
+            for rank, art, publicationTitle, simTitles in zip(range(1, rows + 1), arts, publicationTitles, titleSimilarities):
+                score = art.get('score')  # none for the works resolved by DOI
+                if links and tier == 'search' and score < cutoff:
+                    lines.append(f"# Early cutoff at rank {rank}: score {score} below the floor {cutoff:.3f}")
+                    break
+                publicationDoi = art['DOI'].lower()
+                publicationAuthors = utils.fmtCrossrefAuthors(art)
+                publicationIssued  = utils.fmtCrossrefDate(art['created'])    # checked on 10.1016/j.forsciint.2019.109924 & created more reliable than issued (see 10.2106/jbjs.oa.19.00049 where issue is 2020 only)
+                matchFound = tier != 'search' or isMatch(simTitles, preprintKeys, art)  # relations are deposited links
+                candidates.append(Candidate(rank, publicationDoi, publicationTitle, publicationAuthors, publicationIssued, score, simTitles, matchFound))
+
+                lines.append("#" + str(rank) if tier == 'search' else f"#{rank} (tier {tier})")
+                if matchFound and not publicationDoi.startswith('10.2139/ssrn'):
+                    links.append(Link(preprintDoi, publicationDoi, score, resultNbr, preprintIssued, publicationIssued, publicationTitle, publicationAuthors, tier))
+                    lines.append(linkTsv(links[-1]))
+                    resultNbr += 1
+                    if floor and tier == 'search' and arts[0]['score']:
+                        floor.observe(score / arts[0]['score'])
+        if links:  # no need for the next tier, nor to widen the query
+            utils.metrics.count('links_by_tier_total', len(links), tier=tier)
+            break
+    return lines, Outcome(preprintRecord, candidates, links)
 
+def printPreprintPublicationMatches(crossref, preprintDoi):
+    print('\n'.join(preprintPublicationMatches(crossref, preprintDoi)[0]))
+
+def inferPreprintPublicationLinksViaCrossref(dois, workers=1, state=None, index=None, output=None, rows=20, plan='wide'):
+    """Infer a list of doiPublication for each doiPreprint, querying Crossref with up to `workers` concurrent requests while printing in input order.
+    With a LinkStateStore, only the preprints that are due are queried (incremental daily mode) and the outcome of each check is recorded.
+    With a CandidateIndex, candidates are looked up locally instead of via the Crossref bibliographic query.
+    With a RecordWriter, links are also output as Link records (JSON lines or Parquet).
+    The adaptive plan (not the default, as it costs an extra query per unlinked preprint) starts with a narrow query and cuts off the candidates below a score floor learned along the run (see preprintPublicationMatches)."""
+    crossref = utils.PoliteWorks(etiquette=utils.crossrefEtiquette())
+    today = datetime.date.today()
+    floor = ScoreFloor() if plan == 'adaptive' else None
+    def matches(doi, preprint):
+        try:
+            return doi, *preprintPublicationMatches(crossref, doi, index, preprint, rows, plan, floor)
+        except utils.OfflineCacheMiss as e:
+            return doi, [f'# Uncached request in offline mode for {doi} thus skipping: {e}'], None
+        except (requests.RequestException, ValueError) as e:  # e.g., persistent 5xx, open circuit: left unrecorded in the state store to be retried
+            utils.metrics.count('preprints_failed_total')
+            return doi, [f'# Failed request for {doi} thus skipping: {e}'], None
+    if state:
+        nbNotDue = 0
+        def due(dois):
+            nonlocal nbNotDue
+            for doi in dois:
+                if state.isDue(doi, today):
+                    yield doi
+                else:
+                    nbNotDue += 1
+        dois = due(dois)
+    def resolved(dois):
+        """Pairs each DOI with its metadata, resolved by batches of 100 (None when to be resolved individually)"""
+        for batch in utils.chunks(dois, 100):
+            with utils.metrics.timer('stage_seconds', stage='resolve'):
+                works = utils.resolveDOIs(crossref, batch, select='DOI,author,issued,relation,title')
+            for doi in batch:
+                yield doi, works.get(doi.lower())
+    nbChecked = 0
+    for doi, lines, outcome in utils.orderedMap(lambda pair: matches(*pair), resolved(dois), workers):
+        nbChecked += 1
+        utils.metrics.count('preprints_checked_total')
+        if outcome and outcome.links:
+            utils.metrics.count('preprints_linked_total')
+            utils.metrics.count('links_total', len(outcome.links))
+        with utils.metrics.timer('stage_seconds', stage='output'):
+            print('\n'.join(lines))
+            if state and outcome:
+                state.record(doi, outcome, today)
+            if output and outcome:
+                for link in outcome.links:
+                    output.write(link)
+    if state:
+        print(f'# {nbChecked} preprints checked, {nbNotDue} skipped (already linked or not due yet)')
+    return nbChecked
+
+class PendingIndex:
+    """In-memory index of the pending preprints by title token, author family name and first author ORCID, for the reverse join"""
+    minSimilarity = 0.8  # title similarity accepted without author evidence by isMatch
+
+    def __init__(self, preprints):
+        self.preprints = []  # (Preprint, author keys)
+        self.tokens = {}     # title token -> indices of the preprints
+        self.authors = {}    # family name or ORCID -> indices of the preprints
+        for doi, work in preprints:
+            keys = utils.authorKeys(work)
+            preprint = Preprint(doi, work.get('title', [''])[0], utils.fmtCrossrefAuthors(work), utils.fmtCrossrefDate(work['issued']), keys[0].orcid if keys else None)
+            i = len(self.preprints)
+            self.preprints.append((preprint, keys))
+            for token in utils.titleTokenSet(preprint.title):
+                self.tokens.setdefault(token, []).append(i)
+            for key in set(key.family for key in keys) | ({keys[0].orcid} if keys and keys[0].orcid else set()):
+                self.authors.setdefault(key, []).append(i)
+
+    def candidates(self, art):
+        """Indices of the preprints that art may match: those sharing its first author, or one of its rarest title tokens.
+        A title similarity of minSimilarity requires sharing one of the n - ceil(minSimilarity * n) + 1 rarest of its n tokens (prefix filtering)."""
+        tokens = sorted(utils.titleTokenSet(art.get('title', [''])[0]), key=lambda token: len(self.tokens.get(token, ())))
+        prefix = tokens[:len(tokens) - math.ceil(self.minSimilarity * len(tokens)) + 1] if tokens else []
+        candidates = set(i for token in prefix for i in self.tokens.get(token, ()))
+        firstAuthor = utils.authorKeys(art, 1)
+        if firstAuthor:
+            candidates.update(self.authors.get(firstAuthor[0].family, ()))
+            candidates.update(self.authors.get(firstAuthor[0].orcid, ()) if firstAuthor[0].orcid else ())
+        return candidates
+
+def reverseJoin(crossref, preprints, since, until=None, rows=1000):
+    """Matches the pending preprints (pairs of DOI and Crossref metadata) against the publications created from since (to until), paged once with a cursor,
+    instead of querying Crossref for each preprint. Yields the Outcome of each matched preprint."""
+    index = PendingIndex(preprints)
+    feed = crossref.filter(from_created_date=since)
+    if until:
+        feed = feed.filter(until_created_date=until)
+    for publicationType in ('journal-article', 'proceedings-article', 'book-chapter', 'book-part', 'book-section'):  # same types as candidateQueries
+        feed = feed.filter(type=publicationType)
+    matches = {}  # index of the preprint -> candidates
+    for art in feed.select('author,created,DOI,title').pages(rows):
+        utils.metrics.count('reverse_publications_total')
+        publicationDoi = art['DOI'].lower()
+        publicationTitle = art.get('title', [''])[0].replace('\n\t', ' ')
+        publicationIssued = utils.fmtCrossrefDate(art['created'])
+        for i in index.candidates(art):
+            preprint, keys = index.preprints[i]
+            if publicationIssued < preprint.issued or publicationDoi.startswith('10.2139/ssrn'):
+                continue
+            simTitles = utils.similarity(preprint.title, publicationTitle)
+            if isMatch(simTitles, keys, art):
+                matches.setdefault(i, []).append(Candidate(None, publicationDoi, publicationTitle, utils.fmtCrossrefAuthors(art), publicationIssued, art.get('score'), simTitles, True))
+    for i, candidates in sorted(matches.items()):
+        preprint = index.preprints[i][0]
+        candidates = [c._replace(rank=rank) for rank, c in enumerate(sorted(candidates, key=lambda c: (-c.similarity, c.doi)), 1)]
+        links = [Link(preprint.doi, c.doi, c.score, c.rank, preprint.issued, c.created, c.title, c.authors, 'reverse') for c in candidates]
+        yield Outcome(preprint, candidates, links)
 
-def inferPreprintPublicationLinksViaCrossref(dois):
-    """Infer a list of doiPublication for each doiPreprint"""
-    crossref = cr.Works(etiquette=utils.crossrefEtiquette())
-    for doi in dois:
-        printPreprintPublicationMatches(crossref, doi)
+def reverseLinkPreprints(dois, state=None, output=None, since=None, rows=1000):
+    """Reverse mode of the linker: the pending preprints (not linked yet according to the state store) are matched locally against the feed of the publications
+    created since the last reverse run (or since), so that the number of requests depends on the volume of new publications instead of that of pending preprints"""
+    crossref = utils.PoliteWorks(etiquette=utils.crossrefEtiquette())
+    today = datetime.date.today()
+    since = since or (state and state.lastRun('reverse')) or today - datetime.timedelta(days=1)
+    pending = (doi for doi in dois if not (state and state.isLinked(doi)))
+    preprints = []
+    for batch in utils.chunks(pending, 100):
+        with utils.metrics.timer('stage_seconds', stage='resolve'):
+            works = utils.resolveDOIs(crossref, batch, select='DOI,author,issued,title')
+        preprints += [(doi, works[doi.lower()]) for doi in batch if doi.lower() in works and works[doi.lower()].get('issued')]
+    print(f'# Reverse join of {len(preprints)} pending preprints with the publications created since {since.isoformat()}')
+    nbLinked = 0
+    for outcome in reverseJoin(crossref, preprints, since.isoformat(), today.isoformat(), rows):
+        nbLinked += 1
+        utils.metrics.count('preprints_linked_total')
+        utils.metrics.count('links_total', len(outcome.links))
+        print("\n\n#--------------------------------------------------------------------------------------------------\n")
+        print(f"# Preprint: {outcome.preprint.doi}\n# Authors: {outcome.preprint.authors}\n# Title: {outcome.preprint.title}\n# Reverse join since {since.isoformat()}")
+        print('\n'.join(linkTsv(link) for link in outcome.links))
+        if state:
+            state.record(outcome.preprint.doi, outcome, today)
+        if output:
+            for link in outcome.links:
+                output.write(link)
+    if state:
+        state.saveRun('reverse', today)
+    print(f'# {nbLinked} preprints linked')
+    return nbLinked
 
 # Entry point
 if __name__ == '__main__':
-    inferPreprintPublicationLinksViaCrossref(utils.listDOIs('doi-preprint-list.tsv'))
+    import argparse
+    parser = argparse.ArgumentParser(description='Infer preprint-publication links via Crossref')
+    parser.add_argument('doiFile', nargs='?', default='doi-preprint-list.tsv', help='TSV file (possibly gzipped, or - for stdin) whose first column lists the preprint DOIs')
+    parser.add_argument('--workers', type=int, default=8, help='number of concurrent Crossref requests (rate limited by the X-Rate-Limit-* headers)')
+    parser.add_argument('--state', metavar='SQLITE', help='incremental daily mode: skip linked preprints and re-check unlinked ones with a backoff recorded in this state store (e.g., link-state.sqlite)')
+    parser.add_argument('--output', metavar='FILE', help='also write the links to this JSON lines (.jsonl) or Parquet (.parquet) file')
+    parser.add_argument('--index', metavar='SQLITE', help='take the candidates from this local index (built with candidateIndex.py) instead of the Crossref bibliographic query')
+    parser.add_argument('--rows', type=int, default=20, help='number of candidates fetched (in a single page) per query')
+    parser.add_argument('--plan', choices=['wide', 'adaptive'], default='wide', help='wide: the title and byline query only; adaptive: narrow query first, widened when nothing matches (so two queries per unlinked preprint), with an early cutoff on the score (saving scoring, not requests); compared with loadTest.py --compare-plans')
+    parser.add_argument('--shard', metavar='I/N', help='only process the DOIs of shard I (0 <= I < N) of N, assigned by a stable hash; requires --output, merged with mergeShards.py')
+    parser.add_argument('--reverse', action='store_true', help='reverse mode: match the pending preprints against the feed of the publications created since the last reverse run (recorded in --state)')
+    parser.add_argument('--since', type=datetime.date.fromisoformat, help='reverse mode: match the publications created since this date (YYYY-MM-DD) instead of since the last reverse run')
+    utils.addDOIInputArguments(parser)
+    utils.addHttpCacheArguments(parser)
+    utils.addMetricsArguments(parser)
+    args = parser.parse_args()
+    utils.enableHttpCacheFromArguments(parser, args)
+    utils.enableMetricsFromArguments(args)
+    dois = utils.streamDOIsFromArguments(args.doiFile, args)  # in input order
+    if args.shard:
+        if not args.output:
+            parser.error('--shard requires --output')
+        try:
+            shard, nbShards = utils.parseShard(args.shard)
+        except ValueError as e:
+            parser.error(f'--shard: {e}')
+        if os.path.exists(args.output + '.manifest.json'):  # from a previous run
+            os.remove(args.output + '.manifest.json')
+        dois = (doi for doi in dois if utils.shardOf(doi, nbShards) == shard)
+    index = None
+    if args.index:
+        import candidateIndex
+        index = candidateIndex.CandidateIndex(args.index)
+    output = RecordWriter(args.output) if args.output else None
+    try:
+        state = LinkStateStore(args.state) if args.state else None
+        if args.reverse:
+            nbChecked = reverseLinkPreprints(dois, state, output, args.since)
+        else:
+            nbChecked = inferPreprintPublicationLinksViaCrossref(dois, args.workers, state, index, output, args.rows, args.plan)
+    finally:
+        if output:
+            output.close()
+        utils.writeMetricsFromArguments(args)
+    if args.shard:  # written last: a shard without manifest has failed (see mergeShards.py)
+        with open(args.output + '.manifest.json', 'w') as f:
+            json.dump({'shard': shard, 'shards': nbShards, 'doiFile': args.doiFile, 'checked': nbChecked,
+                       'finished': datetime.datetime.now().isoformat(timespec='seconds')}, f)
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# Local stand-in for the Crossref and bioRxiv APIs, serving the medrxiv gold standard with configurable latency, errors and rate limits
+# @author <a href="mailto:guillaume.cabanac@univ-tlse3.fr">Guillaume Cabanac</a>
+# @since 17-OCT-2026
+
+# Copyright (C) 2026 Guillaume Cabanac
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import gzip, json, random, re, threading, time, urllib.parse, zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import utils
+from matchingBenchmark import crossrefWork, goldFile
+
+origins = ('https://api.crossref.org', 'https://api.biorxiv.org', 'https://doi.org')  # served by the stand-in, see utils.HttpClient.redirect
+
+class StandIn:
+    """Crossref (/works/{doi}, /works?query...&filter=...) and bioRxiv (/details/...) responses generated from the gold standard, and doi.org/doiRA"""
+    def __init__(self, path=goldFile, latency=0.0, errorRate=0.0, rateLimit=50, rateInterval=1, seed=None, relationRate=0.0):
+        self.latency = latency
+        self.relationRate = relationRate  # fraction of the gold links deposited as relations: half is-preprint-of (preprint), half has-preprint (publication)
+        self.errorRate = errorRate
+        self.rateLimit = rateLimit
+        self.rateInterval = rateInterval
+        self.random = random.Random(seed)
+        self.works = {}     # lowercase DOI -> Crossref JSON
+        self.postings = {}  # title token -> DOIs of the publications
+        self.details = {}   # preprint DOI -> bioRxiv versions
+        self.gold = {}      # preprint DOI -> publication DOI
+        self.unpublished = []  # DOIs of the preprints listed without a publication, served as Crossref works as well
+        self.load(path)
+        self.stats = {'requests': 0, 'errors': 0, 'throttled': 0}
+        self.window = (0, 0)  # start of the current rate limit window, nb of requests in it
+        self.lock = threading.Lock()
+
+    def load(self, path):
+        published = {}
+        for line in open(path, encoding='utf-8'):
+            row = line.rstrip('\n').split('\t')
+            if line.startswith('#\t'):  # harvest listing: #, doi, version, date, published, authors, title
+                self.details.setdefault(row[1], []).append({'doi': row[1], 'version': row[2], 'date': row[3], 'published': row[4], 'authors': row[5], 'title': row[6], 'server': 'medrxiv'})
+            elif line.strip() and not line.startswith('#'):
+                preprint, publication = crossrefWork(row[0], row[6], row[7], row[8], row[9]), crossrefWork(row[1], row[10], row[11], row[12], row[13])
+                preprint['type'], publication['type'] = 'posted-content', 'journal-article'
+                self.works[row[0].lower()], self.works[row[1].lower()] = preprint, publication
+                for token in utils.titleTokenSet(row[11]):
+                    self.postings.setdefault(token, []).append(row[1].lower())
+                published[row[0]] = row[1]
+                deposit = zlib.crc32(row[0].lower().encode('utf-8')) % 1000 / 1000  # stable across runs
+                if deposit < self.relationRate / 2:
+                    preprint['relation'] = {'is-preprint-of': [{'id-type': 'doi', 'id': row[1], 'asserted-by': 'subject'}]}
+                elif deposit < self.relationRate:
+                    publication['relation'] = {'has-preprint': [{'id-type': 'doi', 'id': row[0], 'asserted-by': 'subject'}]}
+        for doi, publication in published.items():
+            for version in self.details.get(doi, []):
+                version['published'] = publication
+        for doi, versions in sorted(self.details.items()):
+            if doi not in published and doi.lower() not in self.works:
+                first, last = min(versions, key=lambda v: int(v['version'])), max(versions, key=lambda v: int(v['version']))
+                self.works[doi.lower()] = dict(crossrefWork(doi, first['date'], last['title'], last['authors'], ''), type='posted-content')
+                self.unpublished.append(doi.lower())
+        self.gold = {doi.lower(): publication.lower() for doi, publication in published.items()}
+
+    def throttled(self):
+        """Whether the request exceeds the advertised rate limit"""
+        with self.lock:
+            self.stats['requests'] += 1
+            now = time.monotonic()
+            start, count = self.window
+            if now - start >= self.rateInterval:
+                start, count = now, 0
+            self.window = (start, count + 1)
+            return count + 1 > self.rateLimit
+
+    def handle(self, path):
+        """(status, headers, JSON body) of a GET request"""
+        headers = {'Content-Type': 'application/json', 'X-Rate-Limit-Limit': str(self.rateLimit), 'X-Rate-Limit-Interval': f'{self.rateInterval}s'}
+        if self.throttled():
+            self.stats['throttled'] += 1
+            return 429, dict(headers, **{'Retry-After': str(self.rateInterval)}), {'status': 'error', 'message': 'rate limit exceeded'}
+        if self.latency:
+            time.sleep(self.latency * self.random.uniform(0.5, 1.5))
+        if self.random.random() < self.errorRate:
+            self.stats['errors'] += 1
+            return 503, headers, {'status': 'error', 'message': 'injected error'}
+        parts = urllib.parse.urlsplit(path)
+        params = dict(urllib.parse.parse_qsl(parts.query))
+        route = urllib.parse.unquote(parts.path)
+        if route.startswith('/works/'):
+            work = self.works.get(route[len('/works/'):].lower())
+            return (200, headers, {'status': 'ok', 'message-type': 'work', 'message': work}) if work else (404, headers, {'status': 'error', 'message': 'Resource not found.'})
+        if route == '/works':
+            return 200, headers, {'status': 'ok', 'message-type': 'work-list', 'message': self.search(params)}
+        if route.startswith('/details/'):
+            return 200, headers, self.detailsOf(route[len('/details/'):])
+        if route.lower().startswith('/doira/'):
+            return 200, headers, [{'DOI': doi, 'RA': 'Crossref'} for doi in route[len('/doiRA/'):].split(',')]
+        return 404, headers, {'status': 'error', 'message': 'Resource not found.'}
+
+    def search(self, params):
+        """Works list for the filter (doi, relation.type and relation.object, type, from/until-created-date) and bibliographic query parameters, paged by rows and cursor"""
+        filters = {}
+        for f in filter(None, params.get('filter', '').split(',')):
+            name, _, value = f.partition(':')
+            filters.setdefault(name, set()).add(value.lower())
+        if 'doi' in filters:
+            items = [dict(self.works[doi], score=1.0) for doi in sorted(filters['doi']) if doi in self.works]
+        elif 'relation.object' in filters:
+            relationTypes = filters.get('relation.type') or {'has-preprint', 'is-preprint-of'}
+            items = [dict(work, score=1.0) for doi, work in sorted(self.works.items())
+                     if any(relation['id'].lower() in filters['relation.object'] for relationType in relationTypes for relation in (work.get('relation') or {}).get(relationType, []))]
+        elif 'query.bibliographic' not in params:  # feed of works
+            items = [dict(self.works[doi], score=1.0) for doi in sorted(self.works)]
+        else:
+            scores = {}
+            for token in utils.titleTokenSet(params.get('query.bibliographic', '')):
+                for doi in self.postings.get(token, []):
+                    scores[doi] = scores.get(doi, 0) + 1
+            author = params.get('query.author', '').lower()
+            items = []
+            for doi, score in sorted(scores.items(), key=lambda ds: (-ds[1], ds[0])):
+                work = self.works[doi]
+                if author and work['author'] and (work['author'][0].get('family') or '').lower() in author:
+                    score += 5
+                items.append(dict(work, score=float(score)))
+            items.sort(key=lambda work: -work['score'])
+        if 'type' in filters:
+            items = [work for work in items if work['type'] in filters['type']]
+        if 'from-created-date' in filters:
+            fromDate = min(filters['from-created-date'])
+            items = [work for work in items if '%04d-%02d-%02d' % tuple(work['created']['date-parts'][0]) >= fromDate]
+        if 'until-created-date' in filters:
+            untilDate = max(filters['until-created-date'])
+            items = [work for work in items if '%04d-%02d-%02d' % tuple(work['created']['date-parts'][0]) <= untilDate]
+        rows = int(params.get('rows', 20))
+        offset = int(params['cursor']) if params.get('cursor', '*') != '*' else int(params.get('offset', 0))
+        return {'total-results': len(items), 'items': items[offset:offset + rows], 'items-per-page': rows, 'next-cursor': str(offset + rows)}
+
+    def detailsOf(self, route):
+        """bioRxiv details of a preprint (archive/doi) or of the preprints posted in a date interval (archive/start/end/cursor)"""
+        archive, _, rest = route.partition('/')
+        interval = re.match(r'(\d{4}-\d{2}-\d{2})/(\d{4}-\d{2}-\d{2})(?:/(\d+))?$', rest)
+        if archive != 'medrxiv':
+            collection = []
+        elif interval:
+            start, end, cursor = interval.group(1), interval.group(2), int(interval.group(3) or 0)
+            posted = [version for versions in self.details.values() for version in versions if start <= version['date'] <= end]
+            posted.sort(key=lambda version: (version['date'], version['doi'], version['version']))
+            return {'messages': [{'status': 'ok' if posted[cursor:] else 'no posts found', 'interval': f'{start}:{end}', 'cursor': cursor, 'count': len(posted[cursor:cursor + 100]), 'total': len(posted)}],
+                    'collection': posted[cursor:cursor + 100]}
+        else:
+            collection = self.details.get(rest.lower(), [])
+        return {'messages': [{'status': 'ok' if collection else 'no posts found'}], 'collection': collection}
+
+class StandInHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        status, headers, body = self.server.standIn.handle(self.path)
+        content = json.dumps(body).encode('utf-8')
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            content = gzip.compress(content, 1)
+            headers['Content-Encoding'] = 'gzip'
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):  # quiet
+        pass
+
+def startStandIn(standIn, host='127.0.0.1', port=0):
+    """Serves standIn in a background thread, returning the server (whose URL is http://host:server.server_port)"""
+    server = ThreadingHTTPServer((host, port), StandInHandler)
+    server.daemon_threads = True
+    server.standIn = standIn
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+# Entry point
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Local stand-in for the Crossref and bioRxiv APIs, serving the medrxiv gold standard')
+    parser.add_argument('--gold', default=goldFile, help='medrxiv-gold.tsv as output by medrxiv-gold-collector.py')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0.0, help='mean latency of the responses in seconds (uniformly distributed between 50%% and 150%%)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of the requests answered with a 503 error')
+    parser.add_argument('--rate-limit', type=int, default=50, help='requests allowed per interval (X-Rate-Limit-Limit), 429 beyond')
+    parser.add_argument('--rate-interval', type=int, default=1, help='interval of the rate limit in seconds (X-Rate-Limit-Interval)')
+    parser.add_argument('--relation-rate', type=float, default=0.0, help='fraction of the gold links deposited as is-preprint-of or has-preprint relations')
+    args = parser.parse_args()
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), StandInHandler)
+    server.standIn = StandIn(args.gold, args.latency, args.error_rate, args.rate_limit, args.rate_interval, relationRate=args.relation_rate)
+    print(f'# Serving {len(server.standIn.works)} works and {len(server.standIn.details)} preprints on http://127.0.0.1:{args.port}')
+    server.serve_forever()
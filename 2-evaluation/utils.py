@@ -18,14 +18,523 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-import distance, re
+import contextlib, functools, gzip, hashlib, itertools, json, math, os, random, re, requests, requests.adapters, sqlite3, sys, threading, time, urllib.parse, zlib
+from collections import Counter, deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from unidecode import unidecode
-from crossref.restful import Etiquette
+from crossref.restful import Etiquette, Works
 
 def crossrefEtiquette():
     """ see https://github.com/fabiobatalha/crossrefapi#support-for-polite-requests-etiquette and https://github.com/CrossRef/rest-api-doc#etiquette"""
     return Etiquette('COVID-19 Preprint Tracker', '1.0', 'https://www.irit.fr/~Guillaume.Cabanac/covid19-preprint-tracker', 'guillaume.cabanac@univ-tlse3.fr')
 
+class Metrics:
+    """Counters and histograms of a run (stage timers, HTTP latencies per endpoint, cache hits...), exported as a Prometheus textfile and a JSON summary.
+    Disabled by default, in which case every call returns immediately."""
+    secondsBuckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+    countBuckets   = (0, 1, 5, 10, 20, 50, 100, 1000)
+
+    def __init__(self, prefix='pplinker_'):
+        self.enabled = False
+        self.prefix = prefix
+        self.counters = {}    # (name, labels) -> value
+        self.histograms = {}  # (name, labels) -> [bucket counts..., sum, count]
+        self.buckets = {}     # name -> bucket upper bounds
+        self.lock = threading.Lock()
+        self.started = time.time()
+
+    def count(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))  # label values as strings, whatever their type, to be sortable
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets=secondsBuckets, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))  # label values as strings, whatever their type, to be sortable
+        with self.lock:
+            self.buckets.setdefault(name, buckets)
+            histogram = self.histograms.setdefault(key, [0] * len(buckets) + [0.0, 0])
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram[i] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    @contextlib.contextmanager
+    def timing(self, name, labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def timer(self, name, **labels):
+        """Context manager observing its duration in seconds into the histogram name"""
+        return self.timing(name, labels) if self.enabled else noTimer
+
+    def prometheus(self):
+        """Metrics in the Prometheus text exposition format"""
+        fmtLabels = lambda labels: '{' + ','.join(f'{k}="{v}"' for k, v in labels) + '}' if labels else ''
+        lines = []
+        with self.lock:
+            for name in sorted(set(name for name, labels in self.counters)):
+                lines.append(f'# TYPE {self.prefix}{name} counter')
+                lines += [f'{self.prefix}{name}{fmtLabels(labels)} {value}' for (n, labels), value in sorted(self.counters.items()) if n == name]
+            for name in sorted(self.buckets):
+                lines.append(f'# TYPE {self.prefix}{name} histogram')
+                for (n, labels), histogram in sorted(self.histograms.items()):
+                    if n != name:
+                        continue
+                    for bound, count in zip(self.buckets[name] + ('+Inf',), histogram[:-2] + [histogram[-1]]):
+                        lines.append(f'{self.prefix}{name}_bucket{fmtLabels(labels + (("le", bound),))} {count}')
+                    lines.append(f'{self.prefix}{name}_sum{fmtLabels(labels)} {histogram[-2]}')
+                    lines.append(f'{self.prefix}{name}_count{fmtLabels(labels)} {histogram[-1]}')
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """Metrics as a JSON-serializable run summary"""
+        fmtKey = lambda name, labels: name + ''.join(f'[{k}={v}]' for k, v in labels)
+        with self.lock:
+            summary = {
+                'durationSeconds': round(time.time() - self.started, 3),
+                'counters': {fmtKey(*key): value for key, value in sorted(self.counters.items())},
+                'histograms': {fmtKey(*key): {'count': h[-1], 'sum': round(h[-2], 6), 'mean': round(h[-2] / h[-1], 6) if h[-1] else None,
+                                              'buckets': dict(zip(map(str, self.buckets[key[0]]), h[:-2]))} for key, h in sorted(self.histograms.items())},
+            }
+        hits = sum(v for k, v in summary['counters'].items() if k.startswith('http_cache_requests_total') and '[result=hit]' in k)
+        lookups = sum(v for k, v in summary['counters'].items() if k.startswith('http_cache_requests_total'))
+        summary['httpCacheHitRatio'] = round(hits / lookups, 4) if lookups else None
+        info = titleTokens.cache_info()
+        summary['titleTokensCacheHitRatio'] = round(info.hits / (info.hits + info.misses), 4) if info.hits + info.misses else None
+        return summary
+
+    def write(self, prometheusPath=None, jsonPath=None):
+        """Writes the Prometheus textfile (atomically, as expected by node_exporter) and/or the JSON summary"""
+        for path, content in [(prometheusPath, self.prometheus), (jsonPath, lambda: json.dumps(self.summary(), indent=2))]:
+            if path:
+                with open(path + '.tmp', 'w') as f:
+                    f.write(content())
+                os.replace(path + '.tmp', path)
+
+noTimer = contextlib.nullcontext()
+metrics = Metrics()  # shared by all the instrumented routines, enabled with addMetricsArguments
+
+def addMetricsArguments(parser):
+    """Adds the --metrics-prom and --metrics-json options to an argparse parser, see enableMetricsFromArguments"""
+    parser.add_argument('--metrics-prom', metavar='FILE', help='write run metrics to this Prometheus textfile (e.g., pplinker.prom)')
+    parser.add_argument('--metrics-json', metavar='FILE', help='write a JSON summary of the run metrics to this file')
+
+def enableMetricsFromArguments(args):
+    metrics.enabled = bool(args.metrics_prom or args.metrics_json)
+
+def writeMetricsFromArguments(args):
+    if metrics.enabled:
+        metrics.write(args.metrics_prom, args.metrics_json)
+
+class RateLimiter:
+    """Spaces out requests issued by several threads according to the X-Rate-Limit-Limit and X-Rate-Limit-Interval headers (e.g., 50 requests per 1s)"""
+    def __init__(self, limit=50, interval=1.0):
+        self.limit = limit
+        self.interval = interval
+        self.nextSlot = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """Blocks until the calling thread is allowed to send its request"""
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.nextSlot)
+            self.nextSlot = slot + self.interval / self.limit
+        metrics.observe('rate_limit_wait_seconds', max(0.0, slot - now))
+        time.sleep(max(0.0, slot - now))
+
+    def update(self, headers):
+        """Follows the limits advertised by the server, e.g., X-Rate-Limit-Limit: 50 and X-Rate-Limit-Interval: 1s"""
+        try:
+            limit = int(headers.get('x-rate-limit-limit', self.limit))
+            interval = headers.get('x-rate-limit-interval')
+            if interval:
+                interval = float(interval[:-1]) * {'s': 1, 'm': 60, 'h': 3600}[interval[-1]]
+            else:
+                interval = self.interval
+        except (ValueError, KeyError):  # unexpected header value: keep the previous limits
+            return
+        if limit > 0 and interval > 0:
+            with self.lock:
+                self.limit, self.interval = limit, interval
+
+class OfflineCacheMiss(LookupError):
+    """Raised in offline mode when a response is not in the cache"""
+
+class CachedResponse:
+    """Minimal stand-in for requests.Response, as served by ResponseCache"""
+    def __init__(self, url, status_code, content):
+        self.url = url
+        self.status_code = status_code
+        self.content = content
+        self.headers = {}
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8')
+
+    def json(self):
+        import json
+        return json.loads(self.content)
+
+class ResponseCache:
+    """On-disk (SQLite) cache of HTTP responses keyed on normalized request URLs, with a TTL per endpoint type (overridden by ttl) and LRU eviction beyond maxBytes"""
+    ttl = {  # in seconds
+        'crossref-work':   30 * 86400,  # /works/{doi}: metadata rarely changes
+        'crossref-search':   6 * 3600,  # /works?query...: new publications appear daily, so well below the interval of a daily run
+        'biorxiv':           6 * 3600,
+        'doi-ra':         365 * 86400,  # registration agency of a DOI never changes
+        'other':                86400,
+        'not-found':             3600,  # 404 of any endpoint, e.g., a new preprint not indexed by Crossref yet
+    }
+
+    def __init__(self, path='http-cache.sqlite', maxBytes=2 * 1024**3, offline=False, ttl=None):
+        self.path = path
+        self.ttl = dict(ResponseCache.ttl, **(ttl or {}))
+        self.maxBytes = maxBytes
+        self.offline = offline
+        self.putsSinceEviction = 0
+        self.lock = threading.Lock()
+        if offline:  # read-only: no request is sent and the cache file is left untouched
+            self.db = sqlite3.connect(f'file:{path}?mode=ro', uri=True, check_same_thread=False)
+        else:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, endpoint TEXT, status INTEGER, body BLOB, size INTEGER, fetched REAL, accessed REAL)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS responsesAccessed ON responses (accessed)')
+            self.db.commit()
+
+    @staticmethod
+    def key(url, params=None):
+        """Normalizes a request URL: lowercase host and path (DOIs are case-insensitive), sorted parameters, no mailto"""
+        parts = urllib.parse.urlsplit(url)
+        query = urllib.parse.parse_qsl(parts.query, keep_blank_values=True) + [(k, str(v)) for k, v in (params or {}).items()]
+        query = sorted((k, v) for k, v in query if k != 'mailto')
+        return urllib.parse.urlunsplit(('https', parts.netloc.lower(), urllib.parse.unquote(parts.path).lower(), urllib.parse.urlencode(query), ''))
+
+    @staticmethod
+    def endpoint(key):
+        """Endpoint type of a URL, which determines its TTL"""
+        parts = urllib.parse.urlsplit(key.lower())
+        if parts.netloc == 'api.crossref.org':
+            return 'crossref-work' if parts.path.startswith('/works/') else 'crossref-search'
+        if parts.netloc == 'api.biorxiv.org':
+            return 'biorxiv'
+        if parts.netloc == 'doi.org' and parts.path.startswith('/doira/'):
+            return 'doi-ra'
+        return 'other'
+
+    def get(self, url, params=None):
+        """Returns the cached response to url if still fresh (stale ones are served as well in offline mode), None otherwise"""
+        key = self.key(url, params)
+        with self.lock:
+            row = self.db.execute('SELECT status, body, fetched, endpoint FROM responses WHERE key = ?', (key,)).fetchone()
+            if row and (self.offline or time.time() - row[2] <= self.ttl['not-found' if row[0] == 404 else row[3]]):
+                if not self.offline:
+                    self.db.execute('UPDATE responses SET accessed = ? WHERE key = ?', (time.time(), key))
+                    self.db.commit()
+                return CachedResponse(key, row[0], zlib.decompress(row[1]))
+        if self.offline:
+            raise OfflineCacheMiss(key)
+        return None
+
+    def put(self, url, params, response):
+        """Stores a successful or not-found response"""
+        if self.offline or not (response.status_code < 300 or response.status_code == 404):
+            return
+        key = self.key(url, params)
+        body = zlib.compress(response.content)
+        now = time.time()
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)', (key, self.endpoint(key), response.status_code, body, len(body), now, now))
+            self.db.commit()
+            self.putsSinceEviction += 1
+            if self.putsSinceEviction >= 500:
+                self.putsSinceEviction = 0
+                self.evict()
+
+    def evict(self):
+        """Deletes the least recently used responses until the cache is back under 90% of maxBytes (to be called with the lock held)"""
+        total = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        if total <= self.maxBytes:
+            return
+        victims = []
+        for key, size in self.db.execute('SELECT key, size FROM responses ORDER BY accessed'):
+            if total <= 0.9 * self.maxBytes:
+                break
+            victims.append((key,))
+            total -= size
+        self.db.executemany('DELETE FROM responses WHERE key = ?', victims)
+        self.db.commit()
+
+httpCache = None  # ResponseCache shared by cachedGet and PoliteWorks, see enableHttpCache
+
+def enableHttpCache(path='http-cache.sqlite', offline=False, maxBytes=2 * 1024**3, ttl=None):
+    """Serves the subsequent HTTP requests from (and stores their responses into) the on-disk cache at path"""
+    global httpCache
+    httpCache = ResponseCache(path, maxBytes=maxBytes, offline=offline, ttl=ttl)
+    return httpCache
+
+def addHttpCacheArguments(parser):
+    """Adds the --cache, --offline and --cache-ttl options to an argparse parser, see enableHttpCacheFromArguments"""
+    parser.add_argument('--cache', metavar='SQLITE', help='on-disk cache of the HTTP responses (e.g., http-cache.sqlite)')
+    parser.add_argument('--offline', action='store_true', help='serve every request from --cache, without any network access')
+    parser.add_argument('--cache-ttl', metavar='ENDPOINT=SECONDS', action='append', default=[],
+                        help=f"TTL of the cached responses of an endpoint type ({', '.join(ResponseCache.ttl)}), e.g., crossref-search=3600; repeatable")
+
+def enableHttpCacheFromArguments(parser, args):
+    ttl = {}
+    for option in args.cache_ttl:
+        endpoint, _, seconds = option.partition('=')
+        if endpoint not in ResponseCache.ttl or not seconds.isdigit():
+            parser.error(f'--cache-ttl expects ENDPOINT=SECONDS with ENDPOINT among {", ".join(ResponseCache.ttl)}, not {option}')
+        ttl[endpoint] = int(seconds)
+    if args.cache:
+        enableHttpCache(args.cache, offline=args.offline, ttl=ttl)
+    elif args.offline or ttl:
+        parser.error(f"{'--offline' if args.offline else '--cache-ttl'} requires --cache")
+
+class CircuitOpenError(requests.ConnectionError):
+    """Raised instead of sending a request to a host that keeps failing, until its cooldown has elapsed"""
+
+class RetriesExhaustedError(requests.HTTPError):
+    """Raised when a request still gets a 429/5xx response after all its retries (the last response is its response attribute)"""
+
+class HttpClient:
+    """HTTP client shared by all the scripts: one keep-alive requests.Session per host (whose pool is shared by the threads), gzip,
+    retries of 429/5xx responses and connection errors with a jittered exponential backoff that honors Retry-After,
+    and a circuit breaker that fails fast for cooldown seconds after failureThreshold consecutive failures on a host"""
+    retryStatuses = frozenset([429, 500, 502, 503, 504])
+
+    def __init__(self, retries=5, backoff=1.0, maxBackoff=120.0, failureThreshold=20, cooldown=60.0, poolSize=32):
+        self.retries = retries
+        self.backoff = backoff
+        self.maxBackoff = maxBackoff
+        self.failureThreshold = failureThreshold
+        self.cooldown = cooldown
+        self.poolSize = poolSize
+        self.sessions = {}     # host -> requests.Session
+        self.failures = {}     # host -> nb of consecutive failures
+        self.openUntil = {}    # host -> end of the cooldown of its open circuit
+        self.redirects = {}    # origin -> origin receiving its requests instead
+        self.lock = threading.Lock()
+
+    def redirect(self, origin, target):
+        """Sends the requests for origin (e.g., https://api.crossref.org) to target instead (e.g., a local stand-in server, see standInServer.py)"""
+        self.redirects[origin] = target.rstrip('/')
+
+    def session(self, host):
+        with self.lock:
+            if host not in self.sessions:
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.poolSize)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                session.headers['Accept-Encoding'] = 'gzip'
+                self.sessions[host] = session
+            return self.sessions[host]
+
+    def delay(self, attempt, response):
+        """Seconds to wait before retrying: Retry-After (in seconds or as an HTTP date) when given, otherwise a full-jitter exponential backoff"""
+        retryAfter = response.headers.get('Retry-After') if response is not None else None
+        if retryAfter:
+            try:
+                return min(self.maxBackoff, max(0.0, float(retryAfter)))
+            except ValueError:
+                import email.utils  # only needed for Retry-After dates
+                try:
+                    return min(self.maxBackoff, max(0.0, email.utils.parsedate_to_datetime(retryAfter).timestamp() - time.time()))
+                except (TypeError, ValueError):
+                    pass
+        return random.uniform(0, min(self.maxBackoff, self.backoff * 2 ** attempt))
+
+    def succeeded(self, host):
+        with self.lock:
+            self.failures[host] = 0
+
+    def failed(self, host):
+        with self.lock:
+            self.failures[host] = self.failures.get(host, 0) + 1
+            if self.failures[host] >= self.failureThreshold:
+                self.openUntil[host] = time.monotonic() + self.cooldown
+                metrics.count('http_circuit_opened_total', host=host)
+
+    def request(self, method, url, **kwargs):
+        """requests.request with retries; raises RetriesExhaustedError when they are exhausted on a 429/5xx status, or the last connection error.
+        The latency of each attempt is observed in http_request_seconds, without the backoffs"""
+        endpoint = ResponseCache.endpoint(url) if metrics.enabled else None
+        for origin, target in self.redirects.items():
+            if url.startswith(origin):
+                url = target + url[len(origin):]
+                break
+        host = urllib.parse.urlsplit(url).netloc
+        if time.monotonic() < self.openUntil.get(host, 0):
+            raise CircuitOpenError(f'circuit open for {host} after {self.failures.get(host)} consecutive failures')
+        kwargs.setdefault('timeout', 60)
+        for attempt in range(self.retries + 1):
+            response, error = None, None
+            try:
+                with metrics.timer('http_request_seconds', endpoint=endpoint):
+                    response = self.session(host).request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            if response is not None and response.status_code not in self.retryStatuses:
+                self.succeeded(host)
+                return response
+            self.failed(host)
+            if attempt == self.retries or time.monotonic() < self.openUntil.get(host, 0):
+                break
+            metrics.count('http_retries_total', host=host, reason=str(response.status_code) if response is not None else type(error).__name__)
+            time.sleep(self.delay(attempt, response))
+        if response is not None:
+            raise RetriesExhaustedError(f'{response.status_code} for {url} after {attempt + 1} attempts', response=response)
+        raise error
+
+    def get(self, url, params=None, **kwargs):
+        return self.request('get', url, params=params, **kwargs)
+
+httpClient = HttpClient()
+
+def cachedGet(url, params=None, fetch=None, **kwargs):
+    """GET through the on-disk cache when enabled (fetch is the function performing the actual request, httpClient.get by default)"""
+    fetch = fetch or httpClient.get
+    endpoint = ResponseCache.endpoint(url) if metrics.enabled else None
+    if httpCache is not None:
+        response = httpCache.get(url, params)
+        metrics.count('http_cache_requests_total', endpoint=endpoint, result='miss' if response is None else 'hit')
+        if response is not None:
+            return response
+    try:
+        response = fetch(url, params=params, **kwargs)  # whose latency is observed by httpClient, without the rate limiter waits and backoffs
+    except RetriesExhaustedError as e:
+        metrics.count('http_responses_total', endpoint=endpoint, status=e.response.status_code)
+        raise
+    metrics.count('http_responses_total', endpoint=endpoint, status=response.status_code)
+    if httpCache is not None:
+        httpCache.put(url, params, response)
+    return response
+
+class PoliteWorks(Works):
+    """crossrefapi Works whose requests (including those of derived queries) go through httpClient and the on-disk cache and share one rate limiter instead of each sleeping on its own, so that it can be used by several threads"""
+    rateLimiter = RateLimiter()
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.http_request.throttle = False
+        self.do_http_request = self.politeHttpRequest
+
+    def politeHttpRequest(self, method, endpoint, data=None, only_headers=False, **kwargs):
+        def fetch(url, params=None):
+            self.rateLimiter.wait()
+            headers = kwargs.get('custom_header') or {'user-agent': str(self.etiquette)}
+            if only_headers:
+                result = httpClient.request('head', url, headers=headers, timeout=2)
+            elif method == 'post':
+                result = httpClient.request('post', url, data=params, files=kwargs.get('files'), headers=headers, timeout=kwargs.get('timeout', 100))
+            else:
+                result = httpClient.get(url, params=params, headers=headers, timeout=kwargs.get('timeout', 100))
+            self.rateLimiter.update(result.headers)
+            return result
+        if method != 'get' or only_headers:
+            return fetch(endpoint, data)
+        return cachedGet(endpoint, data, fetch=fetch)
+
+    def top(self, rows=20):
+        """First page of rows results of the query, in a single request (iterating the query fetches pages of 100 results instead)"""
+        params = dict(self.request_params, rows=rows)
+        result = self.do_http_request('get', self.request_url, data=params, custom_header=self.custom_header, timeout=self.timeout)
+        if result.status_code == 404:
+            return []
+        return result.json()['message']['items']
+
+    def pages(self, rows=1000):
+        """Iterates over all the results of the query with a deep-paging cursor, by pages of rows results (up to 1000, instead of the 100 of crossrefapi)"""
+        params = dict(self.request_params, rows=rows, cursor='*')
+        while True:
+            result = self.do_http_request('get', self.request_url, data=params, custom_header=self.custom_header, timeout=self.timeout)
+            if result.status_code == 404:
+                return
+            message = result.json()['message']
+            yield from message['items']
+            if len(message['items']) < rows:
+                return
+            params['cursor'] = message['next-cursor']
+
+def orderedMap(func, items, workers=1):
+    """Lazily applies func to items with a pool of threads, yielding the results in input order with at most 2*workers items in flight"""
+    if workers <= 1:
+        yield from map(func, items)
+        return
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for item in items:
+            pending.append(pool.submit(func, item))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def chunks(items, size):
+    """Lazily splits an iterable into lists of (at most) size items"""
+    items = iter(items)
+    while True:
+        chunk = list(itertools.islice(items, size))
+        if not chunk:
+            return
+        yield chunk
+
+def cachedWork(crossref, doi, select):
+    """Crossref metadata of doi found in the on-disk cache, None if not cached: the work stored by resolveDOIs for these select fields, or the full record fetched by crossref.doi()"""
+    if httpCache is None:
+        return None
+    query = crossref.filter(doi=doi).select(select)
+    for url, params, items in ((query.request_url, dict(query.request_params, rows=1), lambda message: message['items']),
+                               (f'{crossref.request_url}/{doi}', None, lambda message: [message])):
+        try:
+            response = httpCache.get(url, params)
+        except OfflineCacheMiss:
+            continue
+        if response is not None and response.status_code == 200:
+            return items(response.json()['message'])[0]
+    return None
+
+def resolveDOIs(crossref, dois, select='DOI,author,created,issued,title', batchSize=100):
+    """Crossref metadata of DOIs, fetched with one multi-DOI filter request (projected on the select fields) per batchSize DOIs, as a dict keyed on lowercase DOIs.
+    With the on-disk cache, each DOI is looked up in the cache first and only the misses are fetched, each work returned being cached on its own,
+    so that the cache is hit whatever the other DOIs of the batch (e.g., the DOIs due today, or those of a shard).
+    DOIs missing from the results (e.g., not indexed yet, containing a comma, or in a failed batch) are absent: they are to be resolved individually with crossref.doi()"""
+    works, misses = {}, []
+    for doi in sorted(set(doi.lower() for doi in dois if ',' not in doi)):
+        work = cachedWork(crossref, doi, select)
+        if work:
+            works[doi] = work
+        else:
+            misses.append(doi)
+    metrics.count('resolve_cache_hits_total', len(works))
+    for batch in chunks(misses, batchSize):
+        query = crossref
+        for doi in batch:
+            query = query.filter(doi=doi)  # filter=doi:10.1101/xxx,doi:10.1016/yyy,...
+        try:
+            found = query.select(select).top(rows=len(batch))
+        except (OfflineCacheMiss, requests.RequestException, ValueError):  # batch not cached or failed: the DOIs will be resolved individually
+            continue
+        for work in found:
+            doi = work['DOI'].lower()
+            works[doi] = work
+            if httpCache is not None:
+                query = crossref.filter(doi=doi).select(select)
+                httpCache.put(query.request_url, dict(query.request_params, rows=1), CachedResponse(query.url, 200, json.dumps({'status': 'ok', 'message': {'items': [work]}}).encode('utf-8')))
+    return works
+
 def cleanse(txt):
     """Remove newlines and tabs from text"""
     return txt.replace('\n', ' ').replace('\t', ' ')
@@ -34,6 +543,96 @@ def listDOIs(doiFile):
     """Returns the first column (tab-separated) of all rows that do not start with #"""
     return set([ line.split('\t')[0].strip() for line in open(doiFile).readlines() if not line.startswith('#') and len(line.strip()) > 0 ])
 
+class BloomFilter:
+    """Set of keys in constant memory (bits sized for capacity keys), answering that a new key was already added with a probability of about errorRate"""
+    def __init__(self, capacity=10000000, errorRate=1e-6):
+        self.nbBits = max(8, math.ceil(-capacity * math.log(errorRate) / math.log(2) ** 2))
+        self.nbHashes = max(1, round(self.nbBits / capacity * math.log(2)))
+        self.bits = bytearray((self.nbBits + 7) // 8)
+
+    def add(self, key):
+        """Adds key, returning False when it was (probably) already in the filter"""
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        bits, nbBits = self.bits, self.nbBits
+        added = False
+        for bit in range(h1, h1 + self.nbHashes * h2, h2):  # double hashing
+            bit %= nbBits
+            mask = 1 << (bit & 7)
+            if not bits[bit >> 3] & mask:
+                bits[bit >> 3] |= mask
+                added = True
+        return added
+
+class HashSet:
+    """Exact set of keys, stored as 64-bit hashes rather than strings"""
+    def __init__(self):
+        self.hashes = set()
+
+    def add(self, key):
+        h = hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest()
+        if h in self.hashes:
+            return False
+        self.hashes.add(h)
+        return True
+
+def normalizeDOI(doi):
+    """Lowercase DOI without its resolver prefix (https://doi.org/, doi:)"""
+    doi = doi.strip().lower()
+    for prefix in ('https://doi.org/', 'http://doi.org/', 'https://dx.doi.org/', 'http://dx.doi.org/', 'doi:'):
+        if doi.startswith(prefix):
+            return doi[len(prefix):].strip()
+    return doi
+
+def streamDOIs(doiFile, dedup='exact', capacity=10000000):
+    """Lazily yields the normalized DOIs of the first column (tab-separated) of the rows that do not start with #, in input order and without duplicates.
+    doiFile is a TSV or plain list of DOIs, possibly gzipped (.gz), or - for stdin; duplicates are detected with a HashSet (exact), a BloomFilter (constant memory,
+    for inputs of millions of DOIs, but dropping a new DOI with a probability of about its errorRate) or not at all (None).
+    The number of DOIs dropped is counted in input_duplicates_total and reported on stderr"""
+    seen = {'bloom': lambda: BloomFilter(capacity), 'exact': HashSet, None: lambda: None}[dedup]()
+    nbDropped = 0
+    if doiFile == '-':
+        lines = sys.stdin
+    elif doiFile.endswith('.gz'):
+        lines = gzip.open(doiFile, 'rt', encoding='utf-8')
+    else:
+        lines = open(doiFile, encoding='utf-8')
+    with contextlib.nullcontext(lines) if doiFile == '-' else lines:
+        for line in lines:
+            if line.startswith('#') or not line.strip():
+                continue
+            doi = normalizeDOI(line.split('\t')[0])
+            if not doi:
+                continue
+            if seen is None or seen.add(doi):
+                yield doi
+            else:
+                nbDropped += 1
+                metrics.count('input_duplicates_total', dedup=dedup)
+    if nbDropped:
+        print(f'# {nbDropped} duplicate DOIs dropped from {doiFile}' + (' (some may be Bloom filter false positives, see --dedup exact)' if dedup == 'bloom' else ''), file=sys.stderr)
+
+def addDOIInputArguments(parser):
+    """Adds the --dedup and --dedup-capacity options to an argparse parser (see streamDOIs)"""
+    parser.add_argument('--dedup', choices=['exact', 'bloom', 'none'], default='exact', help='de-duplication of the input DOIs: exact (64-bit hashes), Bloom filter (constant memory for inputs of millions of DOIs, '
+                                                                                          'at the risk of dropping a new DOI once in about a million) or none')
+    parser.add_argument('--dedup-capacity', type=int, default=10000000, help='number of DOIs the Bloom filter is sized for')
+
+def streamDOIsFromArguments(doiFile, args):
+    return streamDOIs(doiFile, None if args.dedup == 'none' else args.dedup, args.dedup_capacity)
+
+def shardOf(doi, nbShards):
+    """Shard (0 to nbShards - 1) of a DOI, by a hash that is stable across runs and machines (unlike hash())"""
+    return zlib.crc32(doi.lower().encode('utf-8')) % nbShards
+
+def parseShard(shard):
+    """(shard, nbShards) from a string such as 3/8, where 0 <= shard < nbShards"""
+    i, _, n = shard.partition('/')
+    i, n = int(i), int(n)
+    if not 0 <= i < n:
+        raise ValueError(f'shard {shard} out of range, expecting I/N with 0 <= I < N')
+    return i, n
+
 def fmtCrossrefAuthors(json):
     """Format Crossref JSON for authors as lastname, firstnames"""
     if not json.get('author'):  # no authors in 10.3906/sag-2005-82
@@ -92,25 +691,100 @@ def sameFirstAuthorORCID(art1, art2):
     orcid2 = art2['author'][0].get('ORCID')
     return orcid1 != None and orcid2 != None and orcid1 == orcid2
 
-def similarity(txt1, txt2, func=distance.jaccard): # jaccard = best fit for medrxiv data
-    """Text similarity on tokenized texts"""
-    def asTokens(txt):
-        # Uniformise
-        txt = unidecode(txt)  # change various hyphens: ‐|-|–           
-        # Expand acronyms
-        txt = re.sub('\\bSARS[- ]*CoV[- ]*2\\b', 'Severe Acute Respiratory Syndrome Coronavirus', txt, flags=re.IGNORECASE) # SARS‐CoV             ‐2 asym...  (special dash + many spaces)
-        txt = re.sub('\\bUSA\\b', 'United States of America', txt)
-        txt = re.sub('\\bUS\\b', 'United States', txt)
-        txt = txt.lower()
-        # Tokenize
-        blacklist = ['', 'a', 'an', 'and', 'in', 'of', 'on', 'the', 'to']
-        tokens = []
-        for token in re.split('[^\\w\\d/-]', txt.lower()): # delimiter is non-word except dash (covid-19, non-randomized, open-label)
-            if not token in blacklist:
-                if len(token) > 1: # in some titles <p> -- tokenized as --> p
-                    tokens.append(token if len(token) <= 2 else token[:-1] if token[-1] == 's' else token) # s-stemmer for words with length 3+
-        return tokens
-    return 1 - func(asTokens(txt1), asTokens(txt2))
+AuthorKey = namedtuple('AuthorKey', 'family given orcid')  # family name in lowercase and given names as in bylines (unidecoded, hyphens as spaces), ORCID iD
+
+@functools.lru_cache(maxsize=1 << 16)
+def authorKey(family, given, orcid):
+    """Normalized key of an author, computed once per distinct name"""
+    normalize = lambda name: unidecode(name).replace('-', ' ').strip()
+    return AuthorKey(normalize(family).lower(), normalize(given) if given else None, orcid.rsplit('/', 1)[-1].upper() if orcid else None)
+
+def authorKeys(json, limit=None):
+    """Normalized keys of the (first limit) authors of Crossref JSON, in byline order (see fmtCrossrefAuthors)"""
+    return tuple(authorKey(a.get('family') or a.get('name') or 'No Name Given', a.get('given') if a.get('family') else None, a.get('ORCID')) for a in (json.get('author') or [])[:limit])
+
+def sameAuthor(key1, key2):
+    """Checks if two author keys are likely to be the same person, as sameFirstAuthorNameAndInitial does on bylines"""
+    if key1.given is None or key2.given is None:  # no given names
+        return key1.given == key2.given and key1.family == key2.family
+    if key1.family != key2.family or not key1.given or not key2.given:
+        return False
+    fn1, fn2 = key1.given, key2.given
+    if fn1 == fn1.upper() or fn2 == fn2.upper():  # Initials only
+        return fn1[0] == fn2[0]
+    lenmin = min(3, len(fn1), len(fn2))
+    return fn1[0:lenmin].lower() == fn2[0:lenmin].lower()
+
+def sameFirstAuthor(keys1, keys2):
+    """Checks if the first authors of two author key lists have the same ORCID or are likely to be the same person"""
+    if not keys1 or not keys2:
+        return False
+    return (keys1[0].orcid is not None and keys1[0].orcid == keys2[0].orcid) or sameAuthor(keys1[0], keys2[0])
+
+def sameAuthorSet(keys1, keys2, minAuthors=3):
+    """Checks if two author key lists name the same minAuthors or more authors, whatever their order"""
+    return len(keys1) == len(keys2) >= minAuthors and authorOverlap(keys1, keys2) == len(keys1)
+
+def authorOverlap(keys1, keys2):
+    """Number of authors of keys1 found in keys2 by ORCID, then by family name and first initial, using hashed keys counted as a multiset:
+    each author of keys2 matches at most one author of keys1 (e.g., Wang, Li and Wang, Lei do not both match a single Wang, L.)"""
+    name = lambda key: (key.family, (key.given or ' ')[0].lower())
+    names = Counter(name(key) for key in keys2)
+    orcids = {key.orcid: name(key) for key in keys2 if key.orcid}
+    overlap, unmatched = 0, []
+    for key in keys1:
+        if key.orcid and key.orcid in orcids:
+            names[orcids.pop(key.orcid)] -= 1
+            overlap += 1
+        else:
+            unmatched.append(key)
+    for key in unmatched:
+        if names[name(key)] > 0:
+            names[name(key)] -= 1
+            overlap += 1
+    return overlap
+
+sarsCov2Pattern = re.compile('\\bSARS[- ]*CoV[- ]*2\\b', flags=re.IGNORECASE)  # SARS‐CoV             ‐2 asym...  (special dash + many spaces)
+usaPattern      = re.compile('\\bUSA\\b')
+usPattern       = re.compile('\\bUS\\b')
+tokenDelimiter  = re.compile('[^\\w\\d/-]')  # delimiter is non-word except dash (covid-19, non-randomized, open-label)
+titleStopwords  = frozenset(['', 'a', 'an', 'and', 'in', 'of', 'on', 'the', 'to'])
+
+@functools.lru_cache(maxsize=1 << 16)
+def titleTokens(txt):
+    """Tokenized title as a tuple (memoized, since a preprint title is compared with many candidates)"""
+    # Uniformise
+    txt = unidecode(txt)  # change various hyphens: ‐|-|–
+    # Expand acronyms
+    txt = sarsCov2Pattern.sub('Severe Acute Respiratory Syndrome Coronavirus', txt)
+    txt = usaPattern.sub('United States of America', txt)
+    txt = usPattern.sub('United States', txt)
+    # Tokenize
+    tokens = []
+    for token in tokenDelimiter.split(txt.lower()):
+        if not token in titleStopwords:
+            if len(token) > 1: # in some titles <p> -- tokenized as --> p
+                tokens.append(token if len(token) <= 2 else token[:-1] if token[-1] == 's' else token) # s-stemmer for words with length 3+
+    return tuple(tokens)
+
+@functools.lru_cache(maxsize=1 << 16)
+def titleTokenSet(txt):
+    """Tokenized title as a frozenset (memoized)"""
+    return frozenset(titleTokens(txt))
+
+def similarity(txt1, txt2, func=None): # jaccard = best fit for medrxiv data
+    """Text similarity on tokenized texts, 1 - func distance (distance.jaccard when None)"""
+    if func is None:  # same computation as distance.jaccard, on the memoized token sets (the distance package is not even imported)
+        tokens1, tokens2 = titleTokenSet(txt1), titleTokenSet(txt2)
+        return 1 - (1 - len(tokens1 & tokens2) / float(len(tokens1 | tokens2)))
+    return 1 - func(titleTokens(txt1), titleTokens(txt2))
+
+def similarities(txt, candidates, func=None):
+    """Similarities of txt with each of the candidate texts, tokenizing txt once"""
+    if func is not None:
+        return [similarity(txt, candidate, func) for candidate in candidates]
+    tokens = titleTokenSet(txt)
+    return [1 - (1 - len(tokens & candidateTokens) / float(len(tokens | candidateTokens))) for candidateTokens in map(titleTokenSet, candidates)]
 
 #-- tests -------------------------------------------------------------------------------------------------
 def testSameFirstAuthorNameAndInitial():